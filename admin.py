@@ -1,36 +1,120 @@
-import select
+import asyncio
+import heapq
 import socket
-import pickle
 import sqlite3
 import threading
 import json
 import os
-import tkinter as tk
+import sys
+from collections import defaultdict, deque
 from datetime import datetime
 import time
 
+import events
+import metrics
+import protocol
+
+try:
+	import tkinter as tk
+except ImportError:  # the headless mode runs without tkinter
+	tk = None
+
 
 class Admin:
-	BUFSIZE = 8192
+	BACKLOG = 1024  # pending connections the listening socket queues
 	IP = socket.gethostbyname_ex(socket.gethostname())[-1][0]
 	PORT = 8000
+	STATUS_DELAY = 1  # seconds status changes may wait before they are written to disk
+	METRICS_PORT = 9200  # local port of the prometheus text endpoint, None to turn it off
+	UI_DELAY = 100  # milliseconds between two batches of log lines shown by the gui
+	UI_BATCH = 200  # max log lines shown at once, the rest wait for the next batch
+	USERS_DELAY = 200  # milliseconds between two checks of the gui for users that came online or went offline
+	ONLINE_TIMEOUT = 10  # seconds a peer is considered online after the last message it sent
+	CATALOG_HISTORY = 10000  # catalog changes kept for peers that resync from a version, older ones get a snapshot
+	SUBSCRIBER_BUFFER = 1024 * 1024  # bytes of pushes a subscriber may leave unread before it is disconnected
 
 	def __init__(self):
 		"""
 		init function
 		"""
+		self.metrics = metrics.Registry()
+		self.events = events.EventQueue()  # log lines for the gui or the console
+
 		self.db = sqlite3.connect(r'segment_data.db', check_same_thread=False)
 		cur = self.db.cursor()
+		# readers do not block the writer and commits do not wait for a full fsync
+		cur.execute("PRAGMA journal_mode=WAL")
+		cur.execute("PRAGMA synchronous=NORMAL")
 		cur.execute("""CREATE TABLE IF NOT EXISTS segment_data(
            file_name TEXT,
            segment_index INT,
            max_index INT,
-           user_hash TEXT);
+           user_hash TEXT,
+           file_size INT);
+        """)
+		# databases from before file sizes were recorded
+		columns = [column[1] for column in cur.execute("PRAGMA table_info(segment_data)")]
+		if 'file_size' not in columns:
+			cur.execute("ALTER TABLE segment_data ADD COLUMN file_size INT")
+
+		# one row per file so listing the catalog does not scan every segment
+		cur.execute("""CREATE TABLE IF NOT EXISTS files(
+           file_name TEXT PRIMARY KEY,
+           max_index INT,
+           file_size INT);
+        """)
+		# the piece size of a file, the sha1 digests of its pieces concatenated in piece order and, for erasure
+		# coded files, the number of data and parity shards of every piece
+		cur.execute("""CREATE TABLE IF NOT EXISTS manifests(
+           file_name TEXT PRIMARY KEY,
+           piece_size INT,
+           hashes BLOB,
+           data_shards INT,
+           parity_shards INT);
+        """)
+		# manifests from before erasure coding
+		columns = [column[1] for column in cur.execute("PRAGMA table_info(manifests)")]
+		if 'data_shards' not in columns:
+			cur.execute("ALTER TABLE manifests ADD COLUMN data_shards INT")
+			cur.execute("ALTER TABLE manifests ADD COLUMN parity_shards INT")
+
+		if not cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'segment_data_holder'").fetchone():
+			# databases from before the indexes: drop duplicate holder rows and fill the files table
+			cur.execute("""DELETE FROM segment_data WHERE rowid NOT IN (
+           SELECT MIN(rowid) FROM segment_data GROUP BY file_name, segment_index, user_hash);
+        """)
+			cur.execute("""INSERT OR IGNORE INTO files
+           SELECT file_name, MAX(max_index), MAX(file_size) FROM segment_data GROUP BY file_name ORDER BY MIN(rowid);
+        """)
+			# answers both the holders of a whole file and of a single segment
+			cur.execute("""CREATE UNIQUE INDEX segment_data_holder
+           ON segment_data(file_name, segment_index, user_hash);
         """)
 		self.db.commit()
 		self.current_hash_to_addr = Admin.load_dict_from_json()  # load dict from json
-
-		self.online_peers = {}
+		self.status_changed = threading.Event()  # set when the status dict has changes not yet on disk
+		self.status_lock = threading.Lock()  # one writer of the status file at a time
+
+		self.online_peers = {}  # changed on the event loop only
+
+		# (deadline, user hash) of every online peer. a deadline is only moved forward when it is reached, so a
+		# message costs no heap operation and a peer expires exactly ONLINE_TIMEOUT after its last message
+		self.deadlines = []
+		self.expiry = None  # timer handle of the earliest deadline
+		# user hashes that came online or went offline since the gui redrew them. a set, so it never holds more than
+		# the users, whether a gui drains it or not
+		self.user_changes = set()
+
+		# references to a holder handed out since it last reported its load, the load it has not reported yet
+		self.assigned = defaultdict(int)
+
+		# the catalog of files and online peers is versioned, every change gets the next version and is pushed to
+		# the subscribed peers. versions start over with every run of the admin, the epoch tells the runs apart
+		self.catalog_epoch = os.urandom(8).hex()
+		self.catalog_version = 0
+		self.catalog_changes = deque(maxlen=Admin.CATALOG_HISTORY)  # (version, kind, data)
+		self.subscribers = set()  # stream writers of the subscribed connections
+		self.loop = None  # event loop of the server, changes found by other threads are published on it
 
 	def search_for_parts(self, file_name: str, segment_index: int) -> list:
 		"""
@@ -50,36 +134,81 @@ class Admin:
 		:param data: file segment
 		:return: None
 		"""
-		cur = self.db.cursor()
-		cur.execute("INSERT INTO segment_data VALUES(?, ?, ?, ?);",
-					(data['file name'], data['index'], data['max index'], data['user hash']))
-		self.db.commit()
+		with self.metrics.timer('admin_db_seconds', query='upload segment'):
+			cur = self.db.cursor()
+			cur.execute("INSERT OR IGNORE INTO segment_data VALUES(?, ?, ?, ?, ?);",
+						(data['file name'], data['index'], data['max index'], data['user hash'], data.get('file size')))
+			cur.execute("INSERT OR IGNORE INTO files VALUES(?, ?, ?);",
+						(data['file name'], data['max index'], data.get('file size')))
+			added = cur.rowcount == 1
+			self.db.commit()
+		if added:  # the first segment of a new file
+			self.publish([('file added', data['file name'])])
+
+	def upload_manifest(self, data: dict) -> None:
+		"""
+		stores the piece manifest of a file, replacing an older one
+		:param data: {file name, piece size, hashes, coding: (k, m) or None}
+		:return: None
+		"""
+		with self.metrics.timer('admin_db_seconds', query='upload manifest'):
+			data_shards, parity_shards = data.get('coding') or (None, None)
+			cur = self.db.cursor()
+			cur.execute("INSERT OR REPLACE INTO manifests VALUES(?, ?, ?, ?, ?);",
+						(data['file name'], data['piece size'], data['hashes'], data_shards, parity_shards))
+			self.db.commit()
 
 	def get_distinct_files(self) -> list:
 		"""
 		filter the database for distinct file names to prevent doubles
 		:return: results of query
 		"""
-		cur = self.db.cursor()
-		# Query distinct file_name values
-		cur.execute("SELECT DISTINCT file_name FROM segment_data")
-		distinct_file_names = cur.fetchall()
+		with self.metrics.timer('admin_db_seconds', query='file names'):
+			cur = self.db.cursor()
+			# the files table holds every file name once
+			cur.execute("SELECT file_name FROM files ORDER BY rowid")
+			distinct_file_names = cur.fetchall()
 
 		names = list(map(lambda x: x[0], distinct_file_names))
 		return names
 
+	def get_holder_map(self, file_name: str):
+		"""
+		answers which users hold every segment of a file with one indexed query
+		:param file_name: file name
+		:return: (max index, file size, piece size, piece hashes, (k, m) or None, dict of segment index -> list of
+		user hashes) or None if the file is unknown. piece size and hashes are None for files uploaded before manifests
+		"""
+		with self.metrics.timer('admin_db_seconds', query='holder map'):
+			cur = self.db.cursor()
+			cur.execute("SELECT files.max_index, files.file_size, manifests.piece_size, manifests.hashes, "
+						"manifests.data_shards, manifests.parity_shards FROM files "
+						"LEFT JOIN manifests ON manifests.file_name = files.file_name WHERE files.file_name = ?",
+						(file_name,))
+			file = cur.fetchone()
+			if file is None:
+				return None
+
+			holders = defaultdict(list)
+			cur.execute("SELECT segment_index, user_hash FROM segment_data WHERE file_name = ?", (file_name,))
+			for index, user_hash in cur.fetchall():
+				holders[index].append(user_hash)
+		coding = (file[4], file[5]) if file[4] is not None else None
+		return file[0], file[1], file[2], file[3], coding, holders
+
 	@staticmethod
 	def backup_dict_to_json(data, file_path='status.json') -> None:
 		"""
-		saves the status dict as json
+		saves the status dict as json. every peer is saved as offline until it is heard from again
 		:param data: status dict
 		:param file_path: path
 		:return: None
 		"""
-		for key in data:
-			data[key]['isOnline'] = False
-		with open(file_path, "w") as file:
-			json.dump(data, file)
+		# copy first, the dict is changed by the event loop while it is written
+		status = {key: dict(value, isOnline=False) for key, value in data.copy().items()}
+		with open(file_path + '.tmp', "w") as file:
+			json.dump(status, file)
+		os.replace(file_path + '.tmp', file_path)
 
 	@staticmethod
 	def load_dict_from_json(file_path='status.json') -> dict:
@@ -95,210 +224,426 @@ class Admin:
 		else:
 			return {}
 
-	def run_admin_server(self, root: tk.Tk, listboxes: tuple) -> None:
+	def backup_status(self, delay: float) -> None:
+		"""
+		writes the status dict behind the server. changes are batched so a message only marks the
+		status as changed and the file is rewritten at most once every delay seconds
+		:param delay: seconds to batch changes for
+		:return: None
 		"""
-		runs the admin server. main function.
-		:param root: tkinter window object
-		:param list boxes: tuple of tkinter list box objects
+		while True:
+			self.status_changed.wait()
+			time.sleep(delay)
+			self.status_changed.clear()
+			try:
+				with self.status_lock:
+					Admin.backup_dict_to_json(self.current_hash_to_addr)
+			except OSError:
+				self.status_changed.set()  # try again next round
+
+	def flush_status(self) -> None:
+		"""
+		writes pending status changes right away
 		:return: None
 		"""
-		# Create a TCP socket
-		server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		if self.status_changed.is_set():
+			self.status_changed.clear()
+			with self.status_lock:
+				Admin.backup_dict_to_json(self.current_hash_to_addr)
 
-		# Bind the socket to a specific address and port
-		server_socket.bind((Admin.IP, Admin.PORT))
-		server_socket.setblocking(0)
+	def update_listboxes(self, text: str) -> None:
+		"""
+		queues a line for the log. never blocks, the gui or the console shows it later
+		:param text: text to present
+		:return: None
+		"""
+		self.events.put(text)
+
+	def run_admin_server(self) -> None:
+		"""
+		runs the admin server. main function. blocks the calling thread with the server's event loop
+		:return: None
+		"""
+		asyncio.run(self.serve())
 
-		# Listen for incoming connections
-		server_socket.listen()
+	async def serve(self) -> None:
+		"""
+		accepts peer connections on the event loop, every connection is served by its own task
+		:return: None
+		"""
+		self.loop = asyncio.get_running_loop()
+		server = await asyncio.start_server(self.handle_connection, Admin.IP, Admin.PORT, reuse_address=True,
+											backlog=Admin.BACKLOG)
 
-		# update gui
-		update_listboxes(self, root, listboxes, f"Admin server is listening on {Admin.IP} , {Admin.PORT}")
+		# update log
+		self.update_listboxes(f"Admin server is listening on {Admin.IP} , {Admin.PORT}")
 
-		# List to keep track of client sockets
-		client_sockets = [server_socket]
+		# expose the metrics on this machine
+		if Admin.METRICS_PORT is not None:
+			try:
+				port = self.metrics.serve(Admin.METRICS_PORT)
+				self.update_listboxes(f"Metrics are served at http://127.0.0.1:{port}/metrics")
+			except OSError:
+				self.update_listboxes(f"Could not serve metrics on port {Admin.METRICS_PORT}")
 
-		# update online online peers
-		threading.Thread(target=self.get_online_peers, daemon=True, args=(root, listboxes, 10)).start()
+		# back up status dict
+		threading.Thread(target=self.backup_status, daemon=True, args=(Admin.STATUS_DELAY,)).start()
 
-		while True:
-			# Use select to monitor sockets for read, write, and exception events
-			readable, _, exceptional = select.select(client_sockets, client_sockets, client_sockets)
-
-			for sock in readable:
-				if sock == server_socket:
-					# Accept new client connection
-					client_socket, client_address = server_socket.accept()
-					# print(f"New client connected: {client_address}")
-					client_sockets.append(client_socket)
-				else:
-					try:
-						# Receive data from client
-						data = sock.recv(Admin.BUFSIZE)
-						if data:
-							data = pickle.loads(data)
-							# print(data)
-							# struct = {user hash: str, server sock: (int, str), command: str, data: {} (optional)}
-
-							# update user current sockets
-							self.current_hash_to_addr[data['user hash']] = {
-								'addr': data['server sock'],
-								'isOnline': True,
-								'client sock': sock.getpeername(),
-								'last seen': time.time()}
-
-							# update gui
-							# update_listboxes(self, root, listboxes)
-
-							# back up status dict
-							Admin.backup_dict_to_json(self.current_hash_to_addr)
-
-							# respond to command
-							if data['command'] == 'hello admin!':
-								# when a peer enters the network it will update the admin on its status
-								update_listboxes(self, root, listboxes, f"{data['user hash']} is saying hello!")
-
-							# upload a reference to the database
-							elif data['command'] == 'uploaded segment':
-								# update gui
-								update_listboxes(self, root, listboxes,
-												 f"{data['user hash']} has updated database with {data['data']}")
-
-								self.upload_to_db(data['data'])
-
-							# return a list of online peers
-							elif data['command'] == 'get online peers':
-								online_peers = self.online_peers
-								sendThis = ('update online peers', 0, online_peers)  # [1]: just a number
-								# create temp socket to connect to the peer server
-								tempSock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-								tempSock.connect(data['server sock'])
-								tempSock.send(pickle.dumps(sendThis))
-								tempSock.close()
-
-							# return the addr of a socket who has a segment of a file
-							elif data['command'] == 'request file':
-								# update gui
-								update_listboxes(self, root, listboxes,
-												 f"{data['user hash']} has requested addresses of {data['data']['file name']}")
-
-								threading.Thread(target=self.sendSegmentsAddr, daemon=True,
-												 args=(sock, data['data']['file name'], data['server sock'])).start()
-
-							# return a list of all file_name in database
-							elif data['command'] == 'get file names':
-								# print(data)
-								files = self.get_distinct_files()
-								sendThis = ('distinct names', 0, files)
-								tempSock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-								tempSock.connect(data['server sock'])
-								tempSock.send(pickle.dumps(sendThis))
-								tempSock.close()
-
-						else:
-							# Client closed the connection
-							sock.close()
-							client_sockets.remove(sock)
-
-					except Exception as e:
-						# Client closed the connection
-						sock.close()
-						client_sockets.remove(sock)
-
-			for sock in exceptional:
-				# update gui
-				update_listboxes(self, root, listboxes, f"Exceptional condition on socket: {sock.getpeername()}")
-				sock.close()
-				client_sockets.remove(sock)
-
-	def sendSegmentsAddr(self, sock: socket.socket, file_name: str, addr: tuple) -> None:
-		"""
-		queries the database for suitable addresses for each one of the segments of a file
-		:param sock: socket object
+		async with server:
+			await server.serve_forever()
+
+	async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+		"""
+		a task to handle one peer connection until it is closed
+		:param reader: stream reader of the connection
+		:param writer: stream writer of the connection
+		:return: None
+		"""
+		self.metrics.add('admin_connections', 1)
+		try:
+			while True:
+				frame = await protocol.read_frame_async(reader)
+				if frame is None:  # Client closed the connection
+					break
+
+				msg_type, request_id, payload = frame
+				self.metrics.inc('admin_bytes_received_total', protocol.HEADER.size + len(payload))
+				if msg_type != protocol.COMMAND:
+					continue
+				data = protocol.decode_command(payload)
+				self.metrics.inc('admin_commands_total', command=data['command'])
+				with self.metrics.timer('admin_command_seconds', command=data['command']):
+					await self.handle_command(data, request_id, writer)
+
+		except Exception as e:
+			# Client closed the connection
+			pass
+		finally:
+			self.metrics.add('admin_connections', -1)
+			self.subscribers.discard(writer)
+			writer.close()
+
+	async def handle_command(self, data: dict, request_id: int, writer: asyncio.StreamWriter) -> None:
+		"""
+		responds to a single command of a peer
+		:param data: the command
+		:param request_id: request id of the command
+		:param writer: stream writer of the connection
+		:return: None
+		"""
+		# print(data)
+		# struct = {user hash: str, server sock: (int, str), command: str, data: {} (optional)}
+
+		# return the metrics of the admin. monitoring tools ask too, they are not taken for peers
+		if data['command'] == 'stats':
+			await self.send_reply(writer, ('stats', 0, self.metrics.snapshot()), request_id)
+			return
+
+		# every other command comes from a peer, which is online while it talks
+		if 'user hash' not in data or 'server sock' not in data:
+			await self.send_reply(writer, ('request failed', 0, f"{data['command']} needs a user hash and a server sock"),
+								  request_id)
+			return
+
+		# update user current sockets
+		self.current_hash_to_addr[data['user hash']] = {
+			'addr': data['server sock'],
+			'isOnline': True,
+			'client sock': writer.get_extra_info('peername'),
+			'last seen': time.time(),
+			'load': data.get('load')}  # {uploads, rate} or None
+		self.mark_online(data['user hash'], data['server sock'])
+		if data.get('load') is not None:
+			self.assigned.pop(data['user hash'], None)
+
+		# back up status dict, written behind by backup_status
+		self.status_changed.set()
+
+		# respond to command
+		if data['command'] == 'hello admin!':
+			# when a peer enters the network it will update the admin on its status
+			self.update_listboxes(f"{data['user hash']} is saying hello!")
+
+		# upload a reference to the database
+		elif data['command'] == 'uploaded segment':
+			# update log
+			self.update_listboxes(f"{data['user hash']} has updated database with {data['data']}")
+
+			self.upload_to_db(data['data'])
+
+		# store the piece hashes of a file before its pieces are uploaded
+		elif data['command'] == 'upload manifest':
+			self.upload_manifest(data['data'])
+			await self.send_reply(writer, ('manifest stored', 0, None), request_id)
+
+		# return a list of online peers
+		elif data['command'] == 'get online peers':
+			online_peers = self.online_peers
+			sendThis = ('update online peers', 0, online_peers)  # [1]: just a number
+			await self.send_reply(writer, sendThis, request_id)
+
+		# return the addr of a socket who has a segment of a file
+		elif data['command'] == 'request file':
+			# update log
+			self.update_listboxes(f"{data['user hash']} has requested addresses of {data['data']['file name']}")
+
+			await self.sendSegmentsAddr(data['data']['file name'], writer, request_id)
+
+		# return a list of all file_name in database
+		elif data['command'] == 'get file names':
+			# print(data)
+			files = self.get_distinct_files()
+			sendThis = ('distinct names', 0, files)
+			await self.send_reply(writer, sendThis, request_id)
+
+		# send the catalog once and push its changes from now on
+		elif data['command'] == 'subscribe':
+			sendThis = self.catalog_since(data['data'].get('epoch'), data['data'].get('version'))
+			# subscribed before the reply is written so no change can slip in between
+			self.subscribers.add(writer)
+			await self.send_reply(writer, sendThis, request_id)
+
+		# a peer saying it is alive, its last seen time is already updated
+		elif data['command'] == 'heartbeat':
+			pass
+
+	async def send_reply(self, writer: asyncio.StreamWriter, sendThis: tuple, request_id: int) -> None:
+		"""
+		sends a response on the connection the request came from, the peer matches it by its request id
+		:param writer: stream writer of the connection
+		:param sendThis: response
+		:param request_id: request id of the request being answered
+		:return: None
+		"""
+		frame = protocol.encode_command(sendThis, request_id)
+		self.metrics.inc('admin_bytes_sent_total', len(frame))
+		writer.write(frame)
+		await writer.drain()
+
+	def catalog_since(self, epoch: str, version: int) -> tuple:
+		"""
+		what a peer needs to catch up with the catalog: the changes after its version if they are all still kept,
+		the whole catalog otherwise
+		:param epoch: catalog epoch the peer knows, None if it has no catalog
+		:param version: catalog version the peer knows
+		:return: ('catalog delta', version, [(version, kind, data)]) or
+		('catalog', version, {'epoch': epoch, 'files': [file names], 'peers': {user hash: addr}})
+		"""
+		oldest = self.catalog_changes[0][0] if self.catalog_changes else self.catalog_version + 1
+		if epoch == self.catalog_epoch and oldest - 1 <= version <= self.catalog_version:
+			changes = [change for change in self.catalog_changes if change[0] > version]
+			return 'catalog delta', self.catalog_version, changes
+		return 'catalog', self.catalog_version, {'epoch': self.catalog_epoch,
+												 'files': self.get_distinct_files(),
+												 'peers': dict(self.online_peers)}
+
+	def publish(self, changes: list) -> None:
+		"""
+		gives catalog changes their versions and pushes them to every subscribed peer. the message is encoded once
+		for all of them. a subscriber that leaves too much unread is disconnected, it resyncs from its version once
+		it reconnects. runs on the event loop
+		:param changes: list of (kind, data): ('file added', file name), ('peer online', (user hash, addr)) or
+		('peer offline', user hash)
+		:return: None
+		"""
+		entries = []
+		for kind, data in changes:
+			self.catalog_version += 1
+			entries.append((self.catalog_version, kind, data))
+		self.catalog_changes.extend(entries)
+
+		frame = protocol.encode_command(('catalog delta', self.catalog_version, entries))
+		for writer in list(self.subscribers):
+			if writer.is_closing():
+				self.subscribers.discard(writer)
+				continue
+			if writer.transport.get_write_buffer_size() > Admin.SUBSCRIBER_BUFFER:
+				self.subscribers.discard(writer)
+				writer.transport.abort()  # the unread pushes are dropped with the connection
+				self.metrics.inc('admin_subscribers_dropped_total')
+				continue
+			writer.write(frame)
+			self.metrics.inc('admin_bytes_sent_total', len(frame))
+		self.metrics.inc('admin_catalog_changes_total', len(entries))
+
+	def rank_holders(self, user_hashes: list) -> list:
+		"""
+		orders the holders of a segment by how soon they are expected to serve it: the uploads they are busy
+		with and the references handed out to them, divided by their recent upload rate
+		:param user_hashes: online holders
+		:return: user hashes, the least loaded first
+		"""
+		loads = {user_hash: self.current_hash_to_addr[user_hash].get('load') or {} for user_hash in user_hashes}
+		# a holder that has not uploaded anything yet is assumed to be as fast as the others
+		rates = [load['rate'] for load in loads.values() if load.get('rate')]
+		default_rate = sum(rates) / len(rates) if rates else 1
+
+		def expected_wait(user_hash: str) -> float:
+			load = loads[user_hash]
+			return (load.get('uploads', 0) + self.assigned[user_hash] + 1) / (load.get('rate') or default_rate)
+
+		return sorted(user_hashes, key=expected_wait)
+
+	async def sendSegmentsAddr(self, file_name: str, writer: asyncio.StreamWriter, request_id: int) -> None:
+		"""
+		queries the database for suitable addresses for each one of the segments of a file. segments without an
+		online holder are left out, the peer knows which ones it still needs
 		:param file_name: file name
-		:param addr: tuple of (ip, port)
+		:param writer: stream writer of the requesting connection
+		:param request_id: request id of the peer's request
 		:return: None
 		"""
-		# get the max_index of the file
-		cur = self.db.cursor()
-		cur.execute("SELECT * FROM segment_data WHERE file_name = ?", (file_name,))
-		response = cur.fetchone()
+		holder_map = self.get_holder_map(file_name)
 
-		if not response:  # file doesn't exist
-			sock.send(pickle.dumps(f'File {file_name} not found on database'))
+		if holder_map is None:  # file doesn't exist
+			await self.send_reply(writer, ('request failed', 0, f'File {file_name} not found on database'), request_id)
 			return
 
-		max_index = int(response[2])
+		max_index, file_size, piece_size, hashes, coding, holders = holder_map
+		shards = sum(coding) if coding is not None else 1  # segments per piece
 
 		peers = []
 		online_peers = self.online_peers
 		for index in range(0, max_index + 1):
-			cur.execute("SELECT * FROM segment_data WHERE file_name = ? AND segment_index = ?", (file_name, index))
-			response = cur.fetchall()
-			response = list(filter(lambda peer: peer[3] in online_peers, response))
+			response = list(filter(lambda user_hash: user_hash in online_peers, holders[index]))
+
+			if not response:  # every user having it is offline
+				continue
 
-			if not response:  # could not find a segment. the database is corrupted or every user having it is offline. same problem though
-				sock.send(pickle.dumps(f'Could not retrieve {file_name} from database'))
-				return
+			# every online holder, the least loaded first. the first one is counted as busy with this segment so
+			# the next segments rank the others first
+			response = self.rank_holders(response)
+			self.assigned[response[0]] += 1
+			addrs = [self.current_hash_to_addr[user_hash]['addr'] for user_hash in response]
 
-			# (file_name, index ,max_index, server_sock: (port, ip)) : tuple
-			peers.append(
-				(response[0][0], response[0][1], response[0][2], self.current_hash_to_addr[response[0][3]]['addr']))
+			# (file_name, index ,max_index, server_sock: (port, ip), file_size, piece_size, piece_hash, coding,
+			# ranked server socks) : tuple
+			piece = index // shards
+			piece_hash = bytes(hashes[piece * 20:(piece + 1) * 20]) if hashes is not None else None
+			peers.append((file_name, index, max_index, addrs[0], file_size, piece_size, piece_hash, coding, addrs))
+
+		if not peers:  # the database is corrupted or every user having the file is offline. same problem though
+			await self.send_reply(writer, ('request failed', 0, f'Could not retrieve {file_name} from database'), request_id)
+			return
 
 		# send the list of peers
 		sendThis = ('file references', 0, peers)  # [1]: just a number
-		tempSock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		tempSock.connect(addr)
-		tempSock.send(pickle.dumps(sendThis))
-		tempSock.close()
+		await self.send_reply(writer, sendThis, request_id)
+
+	def mark_online(self, user_hash: str, addr: tuple) -> None:
+		"""
+		a message of a peer just arrived. a peer that was offline, or moved its server, comes online. runs on the
+		event loop
+		:param user_hash: user hash
+		:param addr: server socket address of the peer: (ip, port)
+		:return: None
+		"""
+		if self.online_peers.get(user_hash) == addr:  # its deadline is moved forward once it is reached
+			return
 
-	def get_online_peers(self, root, listboxes, delay: float) -> dict:
+		if user_hash not in self.online_peers:
+			heapq.heappush(self.deadlines, (time.time() + Admin.ONLINE_TIMEOUT, user_hash))
+			self.metrics.add('admin_online_peers', 1)
+			if self.deadlines[0][1] == user_hash:  # the earliest deadline now
+				self.schedule_expiry()
+			self.update_listboxes(f"{user_hash} is online")
+			self.user_changes.add(user_hash)
+		self.online_peers[user_hash] = addr
+		self.publish([('peer online', (user_hash, addr))])
+
+	def schedule_expiry(self) -> None:
 		"""
-		sets the server socket addresses of all the online peers
-		:param root: window object
-		:param listboxes: listboxes tuple
-		:param delay: how long can a peer considered online without sending anything
-		:return: a dict containing all online peers on the network right now
+		sets the timer to the earliest deadline
+		:return: None
 		"""
-		while True:
-			online_peers = {}
-			for user_hash in self.current_hash_to_addr.keys():
-				if time.time() - self.current_hash_to_addr[user_hash]['last seen'] > delay:
-					self.current_hash_to_addr[user_hash]['isOnline'] = False
-				else:
-					self.current_hash_to_addr[user_hash]['isOnline'] = True
-					online_peers[user_hash] = self.current_hash_to_addr[user_hash]['addr']  # tuple: (ip, port)
-			update_listboxes(self, root, listboxes)
-			self.online_peers = online_peers
-			time.sleep(5)
-
-
-def update_listboxes(admin: Admin, root, listboxes, text: str = None) -> None:
+		if self.expiry is not None:
+			self.expiry.cancel()
+		self.expiry = None
+		if self.deadlines:
+			self.expiry = self.loop.call_later(max(self.deadlines[0][0] - time.time(), 0), self.expire_peers)
+
+	def expire_peers(self) -> None:
+		"""
+		takes the peers whose deadline was reached offline, or moves their deadline forward when they sent a
+		message since it was set. runs on the event loop
+		:return: None
+		"""
+		now = time.time()
+		changes = []
+		while self.deadlines and self.deadlines[0][0] <= now:
+			_, user_hash = heapq.heappop(self.deadlines)
+			deadline = self.current_hash_to_addr[user_hash]['last seen'] + Admin.ONLINE_TIMEOUT
+			if deadline > now:  # still talking
+				heapq.heappush(self.deadlines, (deadline, user_hash))
+				continue
+
+			self.current_hash_to_addr[user_hash]['isOnline'] = False
+			del self.online_peers[user_hash]
+			self.metrics.add('admin_online_peers', -1)
+			self.update_listboxes(f"{user_hash} is offline")
+			self.user_changes.add(user_hash)
+			changes.append(('peer offline', user_hash))
+
+		# tell the subscribed peers who left
+		if changes:
+			self.publish(changes)
+		self.schedule_expiry()
+
+
+def show_events(admin: Admin, root, log_listbox) -> None:
+	"""
+	shows the log lines queued since the last call and calls itself again on the gui thread
+	:param admin: Admin object
+	:param root: tkinter window object
+	:param log_listbox: list box of the log
+	:return: None
+	"""
+	lines = admin.events.drain(Admin.UI_BATCH)
+	if lines:
+		log_listbox.insert("end", *lines)
+		log_listbox.see(tk.END)
+	root.after(Admin.UI_DELAY, show_events, admin, root, log_listbox)
+
+
+def show_users(admin: Admin, root, users_listbox, rows: dict = None) -> None:
 	"""
-	updates gui
+	redraws the rows of the users that came online or went offline since the last call and calls itself again on
+	the gui thread. every user is drawn on the first call only
 	:param admin: Admin object
 	:param root: tkinter window object
-	:param listboxes: list boxes objects
-	:param text: text to present
+	:param users_listbox: list box of the users
+	:param rows: user hash -> row of the list box, None on the first call
 	:return: None
 	"""
-	# delete values
-	listboxes[1].delete(1, tk.END)
-	# update values of right
-	for user_hash, data in admin.current_hash_to_addr.items():
-		listboxes[1].insert("end", user_hash + ' - Last seen: ' + "{:.2f}".format(time.time() - admin.current_hash_to_addr[user_hash]['last seen']) + ' s ago')
+	if rows is None:
+		rows = {}
+		# copy first, the dict is changed by the event loop
+		changed = list(admin.current_hash_to_addr.copy())
+	else:
+		changed = []
+		while admin.user_changes:
+			try:
+				changed.append(admin.user_changes.pop())
+			except KeyError:  # emptied meanwhile
+				break
+
+	for user_hash in changed:
+		data = admin.current_hash_to_addr.get(user_hash)
+		if data is None:
+			continue
 		if data['isOnline']:
-			listboxes[1].itemconfig("end", fg="#1AFF1A")
+			text, color = user_hash + ' - Online', "#1AFF1A"
 		else:
-			listboxes[1].itemconfig("end", fg="#DB0D88")
-	# update values of left
-	if text:
-		text = str(f"({datetime.now().strftime('%H:%M:%S')}): " + text)
-		listboxes[0].insert("end", text)
-		listboxes[0].see(tk.END)
+			text, color = user_hash + ' - Last seen: ' + datetime.fromtimestamp(data['last seen']).strftime('%H:%M:%S'), "#DB0D88"
 
-	root.update()
+		if user_hash in rows:
+			users_listbox.delete(rows[user_hash])
+			users_listbox.insert(rows[user_hash], text)
+		else:
+			rows[user_hash] = users_listbox.size()
+			users_listbox.insert("end", text)
+		users_listbox.itemconfig(rows[user_hash], fg=color)
+	root.after(Admin.USERS_DELAY, show_users, admin, root, users_listbox, rows)
 
 
 def main(admin: Admin) -> None:
@@ -346,15 +691,40 @@ def main(admin: Admin) -> None:
 	right_listbox.insert("end", "   Users")
 	right_listbox.itemconfig("end", bg="#FF174D")
 
-	threading.Thread(target=admin.run_admin_server, daemon=True, args=(root, (left_listbox, right_listbox))).start()
+	threading.Thread(target=admin.run_admin_server, daemon=True).start()
+
+	# the network threads only queue what happened, the gui thread shows it in batches
+	show_events(admin, root, left_listbox)
+	show_users(admin, root, right_listbox)
 
 	root.mainloop()
 
+	# the server thread dies with the window, write what it has not written yet
+	admin.flush_status()
+
+
+def main_headless(admin: Admin) -> None:
+	"""
+	runs the admin server without a gui, the log is printed. stops on ctrl+c
+	:param admin: Admin instance
+	:return: None
+	"""
+	threading.Thread(target=admin.run_admin_server, daemon=True).start()
+	try:
+		events.echo(admin.events, Admin.UI_DELAY / 1000)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		admin.flush_status()
+
 
 if __name__ == '__main__':
 	# code starts here
 	try:
-		main(Admin())
+		if '--headless' in sys.argv:
+			main_headless(Admin())
+		else:
+			main(Admin())
 	except:
 		pass
 	finally:
@@ -0,0 +1,174 @@
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import protocol
+
+ADMIN = '''
+import sys
+sys.path.insert(0, {repo!r})
+import admin
+admin.Admin.IP = '127.0.0.1'
+admin.Admin.PORT = {port}
+admin.Admin().run_admin_server()
+'''
+
+
+def free_port() -> int:
+	"""
+	finds a free port on loopback
+	:return: port
+	"""
+	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	sock.bind(('127.0.0.1', 0))
+	port = sock.getsockname()[1]
+	sock.close()
+	return port
+
+
+def cpu_seconds(pid: int) -> float:
+	"""
+	user + system cpu time of a process, linux only
+	:param pid: process id
+	:return: seconds
+	"""
+	with open(f'/proc/{pid}/stat') as file:
+		fields = file.read().rsplit(')', 1)[1].split()
+	return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+async def settle(pid: int, timeout: float) -> None:
+	"""
+	waits until a process stops using the cpu
+	:param pid: process id
+	:param timeout: max seconds to wait
+	:return: None
+	"""
+	deadline = time.perf_counter() + timeout
+	previous = cpu_seconds(pid)
+	while time.perf_counter() < deadline:
+		await asyncio.sleep(0.5)
+		current = cpu_seconds(pid)
+		if current - previous < 0.05:
+			return
+		previous = current
+
+
+async def main(args) -> None:
+	"""
+	connects many fake peers to a real admin on loopback and measures its cpu and latency
+	:param args: parsed arguments
+	:return: None
+	"""
+	port = free_port()
+	workdir = tempfile.mkdtemp()
+	process = subprocess.Popen([sys.executable, '-c', ADMIN.format(repo=REPO, port=port)], cwd=workdir)
+
+	# the admin answers on the request connection, collect the answers here
+	sent = {}
+	latencies = []
+	answered = asyncio.Event()
+	server_sock = ('127.0.0.1', 1)  # never dialed
+
+	# the catalog changes pushed to the subscribed peers, the time every one of them got the new file
+	pushed = []
+	published = None
+	notified = asyncio.Event()
+
+	async def read_replies(reader):
+		while True:
+			frame = await protocol.read_frame_async(reader)
+			if frame is None:
+				return
+			message = protocol.decode_command(frame[2]) if frame[0] == protocol.COMMAND else None
+			if message is not None and message[0] == 'catalog delta' and published is not None and \
+					any(kind == 'file added' for _, kind, _ in message[2]):
+				pushed.append(time.perf_counter() - published)
+				if len(pushed) == args.peers:
+					notified.set()
+			elif frame[1] in sent:
+				latencies.append(time.perf_counter() - sent.pop(frame[1]))
+				if not sent:
+					answered.set()
+
+	for _ in range(100):
+		try:
+			await asyncio.open_connection('127.0.0.1', port)
+			break
+		except OSError:
+			await asyncio.sleep(0.1)
+
+	try:
+		# connect every peer and say hello
+		writers = []
+		readers = []
+		start = time.perf_counter()
+		for i in range(args.peers):
+			reader, writer = await asyncio.open_connection('127.0.0.1', port)
+			writer.write(protocol.encode_command({'user hash': f'LOAD{i:05d}', 'server sock': server_sock,
+												  'command': 'hello admin!'}))
+			writers.append(writer)
+			readers.append(asyncio.create_task(read_replies(reader)))
+		await asyncio.gather(*(writer.drain() for writer in writers))
+		print(f'connected {args.peers} peers in {time.perf_counter() - start:.2f} s')
+
+		# idle phase, every connection stays open. wait until the hellos are processed first
+		await settle(process.pid, args.timeout)
+		before = cpu_seconds(process.pid)
+		await asyncio.sleep(args.idle)
+		idle = (cpu_seconds(process.pid) - before) / args.idle * 100
+		print(f'admin cpu while {args.peers} connections idle: {idle:.1f} %')
+
+		# request phase, every peer asks for the file names at once
+		before = cpu_seconds(process.pid)
+		start = time.perf_counter()
+		for i, writer in enumerate(writers):
+			request_id = protocol.next_request_id()
+			sent[request_id] = time.perf_counter()
+			writer.write(protocol.encode_command({'user hash': f'LOAD{i:05d}', 'server sock': server_sock,
+												  'command': 'get file names'}, request_id))
+		await asyncio.wait_for(answered.wait(), args.timeout)
+		elapsed = time.perf_counter() - start
+		busy = cpu_seconds(process.pid) - before
+		latencies.sort()
+		print(f'{len(latencies)} requests in {elapsed:.2f} s ({len(latencies) / elapsed:.0f} req/s, '
+			  f'admin cpu {busy:.2f} s), p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, '
+			  f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms')
+
+		# push phase, every peer subscribes to the catalog and one new file is announced to all of them
+		for i, writer in enumerate(writers):
+			writer.write(protocol.encode_command({'user hash': f'LOAD{i:05d}', 'server sock': server_sock,
+												  'command': 'subscribe', 'data': {'epoch': None, 'version': None}}))
+		await asyncio.gather(*(writer.drain() for writer in writers))
+		await settle(process.pid, args.timeout)
+		before = cpu_seconds(process.pid)
+		published = time.perf_counter()
+		writers[0].write(protocol.encode_command({'user hash': 'LOAD00000', 'server sock': server_sock,
+												  'command': 'uploaded segment',
+												  'data': {'file name': 'bench', 'index': 0, 'max index': 0,
+														   'user hash': 'LOAD00000'}}))
+		await asyncio.wait_for(notified.wait(), args.timeout)
+		pushed.sort()
+		print(f'new file pushed to {len(pushed)} subscribers in {pushed[-1] * 1000:.1f} ms '
+			  f'(admin cpu {cpu_seconds(process.pid) - before:.2f} s), p50 {pushed[len(pushed) // 2] * 1000:.1f} ms')
+
+		for writer in writers:
+			writer.close()
+	finally:
+		process.kill()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='admin server load test on loopback')
+	parser.add_argument('--peers', type=int, default=1000, help='number of connected peers')
+	parser.add_argument('--idle', type=float, default=5, help='seconds to measure the idle cpu')
+	parser.add_argument('--timeout', type=float, default=120, help='seconds to wait for the answers')
+	asyncio.run(main(parser.parse_args()))
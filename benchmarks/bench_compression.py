@@ -0,0 +1,65 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compression
+
+MB = 1024 * 1024
+
+
+def log_lines(size: int) -> bytes:
+	"""
+	log like text, the kind of content that compresses well
+	:param size: bytes
+	:return: data
+	"""
+	lines = (b'%d INFO request %d served in %d ms from 10.0.%d.%d\n' % (i, i * 7919 % 100000, i % 300, i % 256, i * 31 % 256)
+			 for i in range(size // 30))
+	return b''.join(lines)[:size]
+
+
+def measure(data: bytes, codec: str, fast: bool, piece_size: int) -> tuple:
+	"""
+	compresses data piece by piece like an upload does
+	:param data: data
+	:param codec: codec or None
+	:param fast: fast mode
+	:param piece_size: piece size
+	:return: (MB/s, compressed size / size, pieces compressed)
+	"""
+	start = time.perf_counter()
+	sent = 0
+	compressed = 0
+	for offset in range(0, len(data), piece_size):
+		used, payload = compression.compress(memoryview(data)[offset:offset + piece_size], codec, fast)
+		sent += len(payload)
+		compressed += used is not None
+	elapsed = time.perf_counter() - start
+	return len(data) / MB / elapsed, sent / len(data), compressed
+
+
+def main() -> None:
+	"""
+	measures compression throughput and ratio on text and on random data
+	:return: None
+	"""
+	parser = argparse.ArgumentParser(description='segment compression benchmark')
+	parser.add_argument('--mb', type=int, default=32, help='data size')
+	parser.add_argument('--piece-mb', type=float, default=1, help='piece size')
+	args = parser.parse_args()
+
+	piece_size = int(args.piece_mb * MB)
+	samples = {'text': log_lines(args.mb * MB), 'random': os.urandom(args.mb * MB)}
+	for name, data in samples.items():
+		for codec, fast in (('zlib', True), ('zlib', False), ('lzma', True)):
+			rate, ratio, compressed = measure(data, codec, fast, piece_size)
+			mode = 'fast' if fast else 'default'
+			print(f'{name:6} {codec} {mode:7}: {rate:8.1f} MB/s, {1 / ratio:5.2f}x smaller, '
+				  f'{compressed} of {-(-len(data) // piece_size)} pieces compressed')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,65 @@
+import argparse
+import os
+import sys
+import time
+from math import floor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import erasure
+
+MB = 1024 * 1024
+
+
+def timed(function, repeat: int) -> float:
+	"""
+	best wall time of a function
+	:param function: function without arguments
+	:param repeat: number of runs
+	:return: seconds
+	"""
+	best = float('inf')
+	for _ in range(repeat):
+		start = time.perf_counter()
+		function()
+		best = min(best, time.perf_counter() - start)
+	return best
+
+
+def main() -> None:
+	"""
+	measures reed solomon encode and decode throughput of one piece for a network of N peers
+	:return: None
+	"""
+	parser = argparse.ArgumentParser(description='erasure coding benchmark')
+	parser.add_argument('--peers', type=int, default=10, help='number of peers the piece is spread over')
+	parser.add_argument('--crash', type=float, default=0.5, help='max part of peers that can crash (M)')
+	parser.add_argument('--piece-mb', type=float, default=1, help='piece size')
+	parser.add_argument('--repeat', type=int, default=5, help='runs per measurement')
+	args = parser.parse_args()
+
+	# the same crash tolerance as replication: factor_of_freedom copies survive factor_of_freedom - 1 crashes
+	factor_of_freedom = floor(args.peers // (1 / args.crash) + 1)
+	m = factor_of_freedom - 1
+	k = args.peers - m
+	piece = os.urandom(int(args.piece_mb * MB))
+	shards = {index: erasure.encode(piece, k, m, index) for index in range(k + m)}
+
+	encode = timed(lambda: [erasure.encode(piece, k, m, index) for index in range(k + m)], args.repeat)
+	# worst case, the first m data shards are lost and have to be solved for
+	survivors = {index: shards[index] for index in range(m, k + m)}
+	assert erasure.decode(survivors, k, m, len(piece)) == piece
+	decode = timed(lambda: erasure.decode(survivors, k, m, len(piece)), args.repeat)
+	fast = timed(lambda: erasure.decode({index: shards[index] for index in range(k)}, k, m, len(piece)),
+				 args.repeat)
+
+	size = len(piece) / MB
+	print(f'{args.peers} peers, survives {m} crashes: replication stores {factor_of_freedom}x, '
+		  f'RS({k} + {m}) stores {(k + m) / k:.2f}x')
+	print(f'encode {k + m} shards:          {size / encode:8.1f} MB/s')
+	print(f'decode, {m} data shards lost:  {size / decode:8.1f} MB/s')
+	print(f'decode, data shards only:     {size / fast:8.1f} MB/s')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,268 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from bench_admin_load import ADMIN, cpu_seconds, free_port
+
+MB = 1024 * 1024
+
+# a peer without its gui. it reads one json command per line and answers with one json line
+PEER = '''
+import hashlib, json, os, sys, threading, time
+sys.path.insert(0, {repo!r})
+import peer
+log = []
+peer.Peer.update_listboxes = lambda self, text: log.append(text)
+peer.Peer.ADMIN_IP = '127.0.0.1'
+peer.Peer.ADMIN_PORT = {port}
+peer.Peer.METRICS_PORT = None
+peer.Peer.ERASURE_CODING = {erasure!r}
+peer.Peer.COMPRESSION = {compression!r}
+p = peer.Peer({user_hash!r})
+
+# time every segment request
+latencies = []
+request_segment = p.request_segment
+def timed_request(reference, addr):
+	start = time.perf_counter()
+	data = request_segment(reference, addr)
+	latencies.append(time.perf_counter() - start)
+	return data
+p.request_segment = timed_request
+
+threading.Thread(target=p.run_server, daemon=True).start()
+
+# like the gui, the heartbeat keeps the peer online and the admin pushes the online peers and files to it
+threading.Thread(target=peer.keep_alive, daemon=True, args=(p,)).start()
+
+def wait(condition, timeout):
+	deadline = time.perf_counter() + timeout
+	while time.perf_counter() < deadline:
+		try:
+			if condition():
+				return True
+		except OSError:
+			pass
+		time.sleep(0.1)
+	return False
+
+for line in sys.stdin:
+	command = json.loads(line)
+	reply = {{}}
+	if command['op'] == 'online':
+		reply['ok'] = wait(lambda: len(p.online_peers) >= command['count'], command['timeout'])
+	elif command['op'] == 'upload':
+		start = time.perf_counter()
+		p.file_upload(command['path'])
+		reply['seconds'] = time.perf_counter() - start
+	elif command['op'] == 'registered':
+		def registered():
+			references = p.request_admin('request file', {{'file name': command['name']}})
+			return len(references) == references[0][2] + 1
+		reply['ok'] = wait(registered, command['timeout'])
+	elif command['op'] == 'download':
+		del latencies[:]
+		start = time.perf_counter()
+		p.file_download(command['name'], command['dir'])
+		reply['seconds'] = time.perf_counter() - start
+		path = os.path.join(command['dir'], command['name'])
+		reply['sha1'] = hashlib.sha1(open(path, 'rb').read()).hexdigest() if os.path.exists(path) else None
+		reply['segments'] = latencies
+		reply['log'] = log[-1] if log else None
+	print(json.dumps(reply), flush=True)
+'''
+
+
+def peak_rss(pid: int) -> int:
+	"""
+	the highest resident memory of a process so far, linux only
+	:param pid: process id
+	:return: bytes
+	"""
+	with open(f'/proc/{pid}/status') as file:
+		for line in file:
+			if line.startswith('VmHWM:'):
+				return int(line.split()[1]) * 1024
+	return 0
+
+
+def percentile(values: list, q: float) -> float:
+	"""
+	nearest rank percentile
+	:param values: numbers
+	:param q: 0 <= q <= 1
+	:return: value
+	"""
+	values = sorted(values)
+	return values[min(int(len(values) * q), len(values) - 1)]
+
+
+class Network:
+	"""
+	an admin and N peers on loopback, every one in its own process and working directory
+	"""
+
+	def __init__(self, peers: int, erasure: bool, compression: str):
+		"""
+		init function
+		:param peers: number of peers
+		:param erasure: upload with erasure coding
+		:param compression: upload codec or None
+		"""
+		self.workdir = tempfile.mkdtemp()
+		port = free_port()
+		self.admin = subprocess.Popen([sys.executable, '-c', ADMIN.format(repo=REPO, port=port)], cwd=self.workdir,
+									  stdout=subprocess.DEVNULL)
+		time.sleep(0.5)
+		self.peers = []
+		for i in range(peers):
+			cwd = os.path.join(self.workdir, f'PEER{i:03d}')
+			os.mkdir(cwd)
+			script = PEER.format(repo=REPO, port=port, erasure=erasure, compression=compression,
+								 user_hash=f'PEER{i:03d}')
+			self.peers.append(subprocess.Popen([sys.executable, '-c', script], cwd=cwd, text=True,
+											   stdin=subprocess.PIPE, stdout=subprocess.PIPE))
+
+	@staticmethod
+	def call(process: subprocess.Popen, **command) -> dict:
+		"""
+		sends a command to a peer and waits for its answer
+		:param process: peer process
+		:param command: command fields
+		:return: answer
+		"""
+		process.stdin.write(json.dumps(command) + '\n')
+		process.stdin.flush()
+		line = process.stdout.readline()
+		if not line:
+			raise RuntimeError(f'peer {process.pid} exited')
+		return json.loads(line)
+
+	def cpu(self) -> tuple:
+		"""
+		cpu seconds used so far
+		:return: (admin, all the peers)
+		"""
+		return cpu_seconds(self.admin.pid), sum(cpu_seconds(process.pid) for process in self.peers)
+
+	def close(self) -> None:
+		"""
+		stops every process and deletes their files
+		:return: None
+		"""
+		for process in self.peers + [self.admin]:
+			process.kill()
+			process.wait()
+		shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def run(size: int, peers: int, args) -> dict:
+	"""
+	uploads a file from the first peer and downloads it on the others in turn
+	:param size: file size
+	:param peers: number of peers
+	:param args: parsed arguments
+	:return: results
+	"""
+	network = Network(peers, args.erasure, args.compression)
+	try:
+		# every peer is online once its first message reached the admin
+		if not all(Network.call(process, op='online', count=peers, timeout=args.timeout)['ok']
+				   for process in network.peers):
+			raise RuntimeError('peers did not come online')
+
+		data = random.Random(args.seed).randbytes(size)
+		name = f'bench-{size}.bin'
+		path = os.path.join(network.workdir, name)
+		with open(path, 'wb') as file:
+			file.write(data)
+		expected = hashlib.sha1(data).hexdigest()
+
+		before = network.cpu()
+		upload = Network.call(network.peers[0], op='upload', path=path)['seconds']
+		if not Network.call(network.peers[0], op='registered', name=name, timeout=args.timeout)['ok']:
+			raise RuntimeError('the admin did not register every segment')
+
+		downloads = []
+		segments = []
+		for i in range(args.repeat):
+			# every peer but the uploader takes a turn, the uploader too when it is alone
+			process = network.peers[1 + i % (peers - 1)] if peers > 1 else network.peers[0]
+			answer = Network.call(process, op='download', name=name, dir=tempfile.mkdtemp(dir=network.workdir))
+			if answer['sha1'] != expected:
+				raise RuntimeError(f'download {i} failed: {answer["log"]}')
+			downloads.append(answer['seconds'])
+			segments.extend(answer['segments'])
+		after = network.cpu()
+
+		return {'size': size, 'peers': peers,
+				'upload MB/s': size / MB / upload,
+				'download MB/s': size / MB / percentile(downloads, 0.5),
+				'download p50 ms': percentile(downloads, 0.5) * 1000,
+				'download p99 ms': percentile(downloads, 0.99) * 1000,
+				'segment p50 ms': percentile(segments, 0.5) * 1000,
+				'segment p99 ms': percentile(segments, 0.99) * 1000,
+				'admin cpu s': after[0] - before[0],
+				'peers cpu s': after[1] - before[1],
+				'admin rss MB': peak_rss(network.admin.pid) / MB,
+				'peer rss MB': max(peak_rss(process.pid) for process in network.peers) / MB}
+	finally:
+		network.close()
+
+
+def main() -> None:
+	"""
+	measures uploads and downloads over loopback for every file size and number of peers
+	:return: None
+	"""
+	parser = argparse.ArgumentParser(description='end to end benchmark of an admin and N peers on loopback')
+	parser.add_argument('--sizes-mb', type=float, nargs='+', default=[1, 16, 64], help='file sizes')
+	parser.add_argument('--peers', type=int, nargs='+', default=[2, 4, 8], help='numbers of peers')
+	parser.add_argument('--repeat', type=int, default=5, help='downloads per file')
+	parser.add_argument('--erasure', action='store_true', help='upload with erasure coding')
+	parser.add_argument('--compression', choices=['zlib', 'lzma'], help='upload codec')
+	parser.add_argument('--seed', type=int, default=0, help='seed of the file contents')
+	parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for the network')
+	parser.add_argument('--json', help='save the results to this file')
+	parser.add_argument('--compare', help='results of an earlier run to compare the throughput with')
+	args = parser.parse_args()
+
+	baseline = {}
+	if args.compare:
+		with open(args.compare) as file:
+			baseline = {(result['size'], result['peers']): result for result in json.load(file)}
+
+	results = []
+	for size in args.sizes_mb:
+		for peers in args.peers:
+			result = run(int(size * MB), peers, args)
+			results.append(result)
+			line = (f'{size:6g} MB {peers:3} peers: upload {result["upload MB/s"]:7.1f} MB/s, '
+					f'download {result["download MB/s"]:7.1f} MB/s (p50 {result["download p50 ms"]:.0f} ms, '
+					f'p99 {result["download p99 ms"]:.0f} ms), segment p50 {result["segment p50 ms"]:.1f} ms, '
+					f'p99 {result["segment p99 ms"]:.1f} ms, cpu admin {result["admin cpu s"]:.2f} s '
+					f'peers {result["peers cpu s"]:.2f} s, peak rss admin {result["admin rss MB"]:.0f} MB '
+					f'peer {result["peer rss MB"]:.0f} MB')
+			old = baseline.get((result['size'], peers))
+			if old is not None:
+				line += (f', download {(result["download MB/s"] / old["download MB/s"] - 1) * 100:+.0f} % '
+						 f'upload {(result["upload MB/s"] / old["upload MB/s"] - 1) * 100:+.0f} %')
+			print(line, flush=True)
+
+	if args.json:
+		with open(args.json, 'w') as file:
+			json.dump(results, file, indent=1)
+
+
+if __name__ == '__main__':
+	main()
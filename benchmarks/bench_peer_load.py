@@ -0,0 +1,153 @@
+import argparse
+import asyncio
+import hashlib
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import protocol
+from bench_admin_load import cpu_seconds
+
+# a peer without gui or admin, it prints the address of its server
+PEER = '''
+import sys
+sys.path.insert(0, {repo!r})
+import peer
+peer.Peer.update_listboxes = lambda self, text: None
+peer.Peer.METRICS_PORT = None
+p = peer.Peer('SERVING')
+print(p.server_sock.getsockname()[0], p.server_sock.getsockname()[1], flush=True)
+p.run_server()
+'''
+
+
+def threads(pid: int) -> int:
+	"""
+	number of threads of a process, linux only
+	:param pid: process id
+	:return: threads
+	"""
+	with open(f'/proc/{pid}/status') as file:
+		for line in file:
+			if line.startswith('Threads:'):
+				return int(line.split()[1])
+	return 0
+
+
+def rss(pid: int) -> int:
+	"""
+	resident memory of a process, linux only
+	:param pid: process id
+	:return: bytes
+	"""
+	with open(f'/proc/{pid}/status') as file:
+		for line in file:
+			if line.startswith('VmRSS:'):
+				return int(line.split()[1]) * 1024
+	return 0
+
+
+async def store_segment(addr: tuple, data: bytes) -> None:
+	"""
+	uploads the segment every requester asks for to the serving peer
+	:param addr: server address of the peer
+	:param data: segment
+	:return: None
+	"""
+	# the peer listens once its server thread runs
+	for _ in range(100):
+		try:
+			reader, writer = await asyncio.open_connection(*addr)
+			break
+		except OSError:
+			await asyncio.sleep(0.1)
+	request_id = protocol.next_request_id()
+	writer.write(protocol.encode_command(('download', 'bench', 0, 0, len(data), hashlib.sha1(data).digest(), None),
+										 request_id))
+	writer.write(protocol.HEADER.pack(protocol.DATA, request_id, len(data)) + data)
+	await writer.drain()
+	await protocol.read_frame_async(reader)  # the ack
+	writer.close()
+
+
+async def main(args) -> None:
+	"""
+	many requesters ask one peer for the same segment at once and measure how it copes
+	:param args: parsed arguments
+	:return: None
+	"""
+	workdir = tempfile.mkdtemp()
+	process = subprocess.Popen([sys.executable, '-c', PEER.format(repo=REPO)], cwd=workdir, stdout=subprocess.PIPE,
+							   text=True)
+	ip, port = process.stdout.readline().split()
+	addr = (ip, int(port))
+
+	latencies = []
+	done = asyncio.Event()
+
+	try:
+		data = os.urandom(int(args.segment_mb * 1024 * 1024))
+		await store_segment(addr, data)
+
+		# every requester opens its own connection, asks and waits for the segment on it like request_segment does
+		async def request():
+			start = time.perf_counter()
+			try:
+				reader, writer = await asyncio.open_connection(*addr)
+				request_id = protocol.next_request_id()
+				writer.write(protocol.encode_command(('send segment', 'bench', 0), request_id))
+				await writer.drain()
+				while True:
+					frame = await protocol.read_frame_async(reader)
+					if frame is None:
+						return
+					if frame[0] == protocol.DATA:
+						latencies.append(time.perf_counter() - start)
+						writer.close()
+						return
+			except OSError:
+				pass
+
+		peak_threads = 0
+		peak_rss = 0
+
+		async def sample():
+			nonlocal peak_threads, peak_rss
+			while not done.is_set():
+				peak_threads = max(peak_threads, threads(process.pid))
+				peak_rss = max(peak_rss, rss(process.pid))
+				await asyncio.sleep(0.05)
+
+		sampler = asyncio.create_task(sample())
+		before = cpu_seconds(process.pid)
+		start = time.perf_counter()
+		try:
+			await asyncio.wait_for(asyncio.gather(*(request() for _ in range(args.requesters))), args.timeout)
+		except asyncio.TimeoutError:
+			pass
+		elapsed = time.perf_counter() - start
+		done.set()
+		await sampler
+
+		latencies.sort()
+		served = len(latencies)
+		print(f'{args.requesters} requesters, {served} served in {elapsed:.2f} s '
+			  f'({served * len(data) / 1024 / 1024 / elapsed:.0f} MB/s, peer cpu {cpu_seconds(process.pid) - before:.2f} s)')
+		if latencies:
+			print(f'latency p50 {latencies[served // 2] * 1000:.0f} ms, p99 {latencies[int(served * 0.99)] * 1000:.0f} ms')
+		print(f'peer peak threads {peak_threads}, peak rss {peak_rss / 1024 / 1024:.0f} MB')
+	finally:
+		process.kill()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='one peer serving a segment to many requesters on loopback')
+	parser.add_argument('--requesters', type=int, default=500, help='number of concurrent requesters')
+	parser.add_argument('--segment-mb', type=float, default=1, help='segment size')
+	parser.add_argument('--timeout', type=float, default=120, help='seconds to wait for every segment')
+	asyncio.run(main(parser.parse_args()))
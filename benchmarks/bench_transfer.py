@@ -0,0 +1,145 @@
+import argparse
+import io
+import os
+import pickle
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import protocol
+import transfer
+
+BUFSIZE = 1024 * 256
+MB = 1024 * 1024
+
+
+def legacy_send(sock: socket.socket, data: bytes, delay: float) -> None:
+	"""
+	the old send_segment: pickled (chunk, more flag) tuples paced by time.sleep
+	:param sock: socket object
+	:param data: segment
+	:param delay: sleep between chunks
+	:return: None
+	"""
+	sock.sendall(pickle.dumps(('prepare for data requested', 'bench', 0, 0)))
+	time.sleep(delay)
+	chunks = [data[j:j + BUFSIZE - 100] for j in range(0, len(data), BUFSIZE - 100)]
+	for i, chunk in enumerate(chunks):
+		time.sleep(delay)
+		sock.sendall(pickle.dumps((chunk, i != len(chunks) - 1)))
+	time.sleep(delay)
+	time.sleep(delay)
+	sock.shutdown(socket.SHUT_WR)
+
+
+def legacy_receive(conn: socket.socket) -> bytes:
+	"""
+	the old handle_client: pickled chunks glued with bytes concatenation. the old code assumed one
+	pickle per recv which does not even hold on loopback, so the stream is unpickled as a whole here
+	:param conn: socket object
+	:return: segment
+	"""
+	stream = bytearray()
+	while True:
+		data = conn.recv(BUFSIZE)
+		if not data:
+			break
+		stream += data
+	unpickler = pickle.Unpickler(io.BytesIO(stream))
+	unpickler.load()
+	file_data = b''
+	while True:
+		data = unpickler.load()
+		file_data += data[0]
+		if not data[1]:
+			return file_data
+
+
+def engine_send(sock: socket.socket, data: bytes, limiter: transfer.RateLimiter) -> None:
+	"""
+	the transfer engine: one DATA frame paced by tcp backpressure, then wait for the ack
+	:param sock: socket object
+	:param data: segment
+	:param limiter: rate limiter
+	:return: None
+	"""
+	request_id = protocol.next_request_id()
+	protocol.send_command(sock, ('prepare for data requested', 'bench', 0, 0), request_id)
+	transfer.send_payload(sock, data, request_id, limiter)
+	reader = protocol.FrameReader(sock)
+	while reader.read_frame()[:2] != (protocol.ACK, request_id):
+		pass
+
+
+def engine_receive(conn: socket.socket) -> bytes:
+	"""
+	receives one command and its DATA frame and acknowledges it
+	:param conn: socket object
+	:return: segment
+	"""
+	reader = protocol.FrameReader(conn)
+	reader.read_frame()
+	_, request_id, payload = reader.read_frame()
+	protocol.send_ack(conn, request_id)
+	return payload
+
+
+def run(size: int, sender, receiver) -> float:
+	"""
+	transfers one segment over loopback
+	:param size: segment size in bytes
+	:param sender: function(sock, data)
+	:param receiver: function(conn) -> bytes
+	:return: throughput in MB/s
+	"""
+	data = os.urandom(size)
+	server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	server.bind(('127.0.0.1', 0))
+	server.listen()
+	result = []
+
+	def serve():
+		conn, _ = server.accept()
+		result.append(receiver(conn))
+		conn.close()
+
+	thread = threading.Thread(target=serve)
+	thread.start()
+	sock = socket.create_connection(server.getsockname())
+	start = time.perf_counter()
+	sender(sock, data)
+	thread.join()
+	elapsed = time.perf_counter() - start
+	sock.close()
+	server.close()
+	if result[0] != data:
+		raise RuntimeError('Received segment does not match the one sent')
+	return size / MB / elapsed
+
+
+def main() -> None:
+	"""
+	prints loopback throughput of the old paced path and the transfer engine
+	:return: None
+	"""
+	parser = argparse.ArgumentParser(description='loopback segment transfer benchmark')
+	parser.add_argument('--legacy-mb', type=int, default=8, help='segment size for the old path')
+	parser.add_argument('--mb', type=int, default=256, help='segment size for the transfer engine')
+	parser.add_argument('--delay', type=float, default=0.07, help='per chunk sleep of the old path')
+	parser.add_argument('--rate', type=float, default=None, help='optional cap in MB/s for the engine')
+	args = parser.parse_args()
+
+	legacy = run(args.legacy_mb * MB, lambda s, d: legacy_send(s, d, args.delay), legacy_receive)
+	print(f'before (pickle + sleep {args.delay}s, {args.legacy_mb} MB): {legacy:10.1f} MB/s')
+
+	limiter = transfer.RateLimiter(args.rate * MB if args.rate else None)
+	engine = run(args.mb * MB, lambda s, d: engine_send(s, d, limiter), engine_receive)
+	cap = f', cap {args.rate} MB/s' if args.rate else ''
+	print(f'after  (framed + backpressure{cap}, {args.mb} MB): {engine:10.1f} MB/s')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,47 @@
+import lzma
+import zlib
+
+SAMPLE_SIZE = 16 * 1024  # bytes at the start of a segment that decide if it is worth compressing
+MIN_SAVING = 0.1  # segments whose sample shrinks by less than this are sent as they are
+
+# codec -> (compress(data, fast), decompress(data))
+CODECS = {
+	'zlib': (lambda data, fast: zlib.compress(data, 1 if fast else 6), zlib.decompress),
+	'lzma': (lambda data, fast: lzma.compress(data, preset=0 if fast else 6), lzma.decompress),
+}
+
+
+def compress(data, codec: str, fast: bool = True) -> tuple:
+	"""
+	compresses a segment unless it does not pay off. a sample of its start is compressed first so
+	media and other compressed data cost almost nothing
+	:param data: bytes-like segment
+	:param codec: 'zlib', 'lzma' or None for no compression
+	:param fast: trade ratio for speed
+	:return: (codec or None, payload)
+	"""
+	if codec is None or not len(data):
+		return None, data
+	sample = memoryview(data)[:SAMPLE_SIZE]
+	if len(zlib.compress(sample, 1)) > len(sample) * (1 - MIN_SAVING):
+		return None, data
+
+	payload = CODECS[codec][0](data, fast)
+	if len(payload) >= len(data):  # the start compressed but the rest did not
+		return None, data
+	return codec, payload
+
+
+def decompress(payload, codec: str):
+	"""
+	restores a segment
+	:param payload: bytes-like payload
+	:param codec: the codec the segment was compressed with, None if it was not
+	:return: segment
+	"""
+	if codec is None:
+		return payload
+	try:
+		return CODECS[codec][1](payload)
+	except (KeyError, zlib.error, lzma.LZMAError) as e:
+		raise ValueError(f'Could not decompress a {codec} segment') from e
@@ -0,0 +1,210 @@
+import socket
+import threading
+import time
+
+import pending
+import protocol
+import transfer
+
+
+class Connection:
+	"""
+	a persistent connection that multiplexes many requests. every response carries the request id of
+	its request and a reader thread hands it to whoever is waiting for it. a response is a command, an
+	acknowledgement, or a command announcing the DATA frame that follows it
+	"""
+
+	def __init__(self, addr: tuple, on_message=None, timeout: float = None):
+		"""
+		init function
+		:param addr: (ip, port) to connect to
+		:param on_message: function(request id, message) for messages nobody is waiting for
+		:param timeout: seconds to wait for the connection to be established
+		"""
+		self.sock = socket.create_connection(tuple(addr), timeout)
+		self.sock.settimeout(None)
+		self.on_message = on_message
+		self.send_lock = threading.Lock()
+		self.pending = pending.PendingRequests()
+		self.expects_data = set()  # request ids answered with a command and a DATA frame
+		self.headers = dict()  # request id -> the command announcing its DATA frame
+		self.on_header = dict()  # request id -> function(command) called once the announcing command arrived
+		self.last_used = time.monotonic()
+		self.closed = False
+
+		threading.Thread(target=self.read_loop, daemon=True).start()
+
+	def read_loop(self) -> None:
+		"""
+		receives responses until the connection closes
+		:return: None
+		"""
+		reader = protocol.FrameReader(self.sock)
+		try:
+			while True:
+				frame = reader.read_frame()
+				if frame is None:
+					break
+				msg_type, request_id, payload = frame
+				self.last_used = time.monotonic()
+				if msg_type == protocol.ACK:
+					self.pending.resolve(request_id, True)
+					continue
+				if msg_type == protocol.DATA:
+					self.pending.resolve(request_id, (self.headers.pop(request_id, None), payload))
+					continue
+				message = protocol.decode_command(payload)
+				if request_id in self.expects_data:
+					if message[0] == 'request failed':  # no DATA frame is coming
+						self.pending.fail(request_id, ConnectionError(message[2]))
+					else:
+						self.headers[request_id] = message
+						callback = self.on_header.pop(request_id, None)
+						if callback is not None:
+							callback(message)
+					continue
+				if not self.pending.resolve(request_id, message) and self.on_message is not None:
+					self.on_message(request_id, message)
+		except OSError:
+			pass
+		finally:
+			self.close()
+
+	def send(self, command, request_id: int = 0) -> None:
+		"""
+		sends a message without waiting for a response
+		:param command: picklable control message
+		:param request_id: request id
+		:return: None
+		"""
+		with self.send_lock:
+			self.last_used = time.monotonic()
+			protocol.send_command(self.sock, command, request_id)
+
+	def send_data(self, command, data, request_id: int, limiter: transfer.RateLimiter = None) -> None:
+		"""
+		sends a command and the DATA frame it announces, nothing else is sent in between
+		:param command: picklable control message
+		:param data: bytes-like payload
+		:param request_id: request id of both frames
+		:param limiter: RateLimiter or None
+		:return: None
+		"""
+		with self.send_lock:
+			self.last_used = time.monotonic()
+			protocol.send_command(self.sock, command, request_id)
+			transfer.send_payload(self.sock, data, request_id, limiter)
+
+	def request(self, command, timeout: float):
+		"""
+		sends a request and blocks until its response arrives
+		:param command: picklable control message
+		:param timeout: seconds to wait
+		:return: the response
+		"""
+		request_id, future = self.pending.register()
+		try:
+			self.send(command, request_id)
+		except OSError:
+			self.close()
+			raise
+		return self.pending.wait(request_id, future, timeout)
+
+	def request_data(self, command, timeout: float, on_header=None) -> tuple:
+		"""
+		sends a request that is answered with a DATA frame and blocks until the whole frame arrived
+		:param command: picklable control message
+		:param timeout: seconds to wait
+		:param on_header: function(command) called on the reader thread once the command announcing the data
+		arrived, None for no call
+		:return: (the command announcing the data, payload)
+		"""
+		request_id, future = self.pending.register()
+		self.expects_data.add(request_id)
+		if on_header is not None:
+			self.on_header[request_id] = on_header
+		try:
+			try:
+				self.send(command, request_id)
+			except OSError:
+				self.close()
+				raise
+			return self.pending.wait(request_id, future, timeout)
+		finally:
+			self.expects_data.discard(request_id)
+			self.headers.pop(request_id, None)
+			self.on_header.pop(request_id, None)
+
+	def idle(self) -> float:
+		"""
+		seconds since anything was sent or received, 0 while requests are waiting for their response
+		:return: seconds
+		"""
+		if self.pending.futures:
+			return 0
+		return time.monotonic() - self.last_used
+
+	def close(self) -> None:
+		"""
+		closes the connection and fails every request still waiting
+		:return: None
+		"""
+		self.closed = True
+		self.pending.fail_all(ConnectionError('Connection closed'))
+		try:
+			self.sock.close()
+		except OSError:
+			pass
+
+
+class ConnectionPool:
+	"""
+	one persistent Connection per server address, opened on first use and shared by every request to
+	that address. a connection is replaced once it was closed or stayed unused for too long
+	"""
+
+	def __init__(self, timeout: float = None, max_idle: float = None):
+		"""
+		init function
+		:param timeout: seconds to wait for a connection to be established
+		:param max_idle: seconds a connection may stay unused before it is replaced, None to keep it forever.
+		keep it below the time the other side drops silent connections after
+		"""
+		self.timeout = timeout
+		self.max_idle = max_idle
+		self.connections = dict()  # (ip, port) -> Connection
+		self.lock = threading.Lock()
+
+	def get(self, addr: tuple) -> Connection:
+		"""
+		the connection to an address, connected if there is none yet
+		:param addr: (ip, port)
+		:return: Connection object
+		"""
+		addr = tuple(addr)
+		with self.lock:
+			conn = self.connections.get(addr)
+			if conn is not None and not conn.closed and (self.max_idle is None or conn.idle() < self.max_idle):
+				return conn
+		if conn is not None:
+			conn.close()
+
+		# connect without the lock so a slow address does not hold up the others
+		new = Connection(addr, timeout=self.timeout)
+		with self.lock:
+			current = self.connections.get(addr)
+			if current is not None and current is not conn and not current.closed:  # someone else connected meanwhile
+				new.close()
+				return current
+			self.connections[addr] = new
+		return new
+
+	def close(self) -> None:
+		"""
+		closes every connection
+		:return: None
+		"""
+		with self.lock:
+			connections, self.connections = self.connections, dict()
+		for conn in connections.values():
+			conn.close()
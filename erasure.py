@@ -0,0 +1,179 @@
+from functools import lru_cache
+
+# numpy is only needed by peers that use erasure coding, it is imported the first time a table is built
+
+MAX_SHARDS = 256  # the cauchy matrix needs k + m distinct elements of GF(256)
+
+
+def _numpy():
+	"""
+	imports numpy
+	:return: numpy module
+	"""
+	try:
+		import numpy
+	except ImportError as e:
+		raise ImportError('erasure coding needs numpy, install it with "pip install numpy"') from e
+	return numpy
+
+
+@lru_cache(maxsize=None)
+def _tables() -> tuple:
+	"""
+	builds the GF(256) tables once. the field is generated by 2 modulo x^8 + x^4 + x^3 + x^2 + 1
+	:return: (multiplication table, inverse table) as numpy arrays
+	"""
+	np = _numpy()
+	exp = np.zeros(510, dtype=np.uint8)
+	log = np.zeros(256, dtype=np.int32)
+	x = 1
+	for i in range(255):
+		exp[i] = x
+		log[x] = i
+		x <<= 1
+		if x & 0x100:
+			x ^= 0x11d
+	exp[255:] = exp[:255]
+
+	# mul[a] is the table of a * b for every b, so a whole shard is multiplied by one lookup
+	mul = exp[log[:, None] + log[None, :]]
+	mul[0, :] = 0
+	mul[:, 0] = 0
+	inverse = exp[255 - log]
+	inverse[0] = 0
+	return mul, inverse
+
+
+def _coefficients(k: int, m: int, index: int) -> list:
+	"""
+	the row of the systematic cauchy generator matrix that makes a shard. any k of its k + m rows are
+	independent, so any k shards rebuild the data
+	:param k: number of data shards
+	:param m: number of parity shards
+	:param index: shard index
+	:return: k coefficients
+	"""
+	if index < k:
+		return [int(column == index) for column in range(k)]
+	_, inverse = _tables()
+	return [int(inverse[index ^ column]) for column in range(k)]
+
+
+@lru_cache(maxsize=None)
+def _wide_table(coefficient: int):
+	"""
+	multiplies two bytes at once, a lookup per byte pair halves the lookups of a shard
+	:param coefficient: GF(256) element
+	:return: numpy uint16 array of coefficient * (a, b) for every pair of bytes
+	"""
+	np = _numpy()
+	mul, _ = _tables()
+	pairs = np.arange(65536)
+	return mul[coefficient][pairs & 0xff].astype(np.uint16) | (mul[coefficient][pairs >> 8].astype(np.uint16) << 8)
+
+
+def _pairs(rows):
+	"""
+	turns rows of bytes into the lookup indexes of their byte pairs. made once and used for every combination
+	:param rows: 2d uint8 numpy array with an even row length
+	:return: 2d numpy array of indexes
+	"""
+	np = _numpy()
+	return rows.view(np.uint16).astype(np.intp)
+
+
+def _combine(coefficients: list, pairs) -> bytes:
+	"""
+	the GF(256) linear combination of equally long rows
+	:param coefficients: one coefficient per row
+	:param pairs: byte pair indexes of the rows, from _pairs
+	:return: combined row
+	"""
+	np = _numpy()
+	out = np.zeros(pairs.shape[1], dtype=np.uint16)
+	product = np.empty_like(out)
+	for coefficient, row in zip(coefficients, pairs):
+		if coefficient:
+			np.take(_wide_table(coefficient), row, out=product)
+			out ^= product
+	return out.tobytes()
+
+
+def shard_length(length: int, k: int) -> int:
+	"""
+	length of every shard of a piece. it is even so shards are combined two bytes at a time
+	:param length: piece length
+	:param k: number of data shards
+	:return: shard length
+	"""
+	length = -(-length // k)
+	return length + length % 2
+
+
+def encode(data, k: int, m: int, index: int) -> bytes:
+	"""
+	makes one shard of a piece. shards below k are slices of the piece, the rest are parity
+	:param data: bytes-like piece
+	:param k: number of data shards
+	:param m: number of parity shards
+	:param index: shard index, 0 <= index < k + m
+	:return: shard
+	"""
+	if not 0 <= index < k + m or k + m > MAX_SHARDS:
+		raise ValueError(f'No shard {index} in a {k} + {m} code')
+	np = _numpy()
+	length = shard_length(len(data), k)
+	if index < k:
+		shard = bytes(memoryview(data)[index * length:(index + 1) * length])
+		return shard + bytes(length - len(shard))
+
+	# the last data shard is padded with zeros
+	rows = np.zeros(k * length, dtype=np.uint8)
+	rows[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+	return _combine(_coefficients(k, m, index), _pairs(rows.reshape(k, length)))
+
+
+def _invert(matrix: list) -> list:
+	"""
+	inverts a square matrix over GF(256) by gauss jordan elimination
+	:param matrix: list of rows of ints
+	:return: inverse matrix
+	"""
+	mul, inverse = _tables()
+	size = len(matrix)
+	rows = [list(row) + [int(i == j) for j in range(size)] for i, row in enumerate(matrix)]
+	for column in range(size):
+		pivot = next(i for i in range(column, size) if rows[i][column])
+		rows[column], rows[pivot] = rows[pivot], rows[column]
+		scale = mul[int(inverse[rows[column][column]])]
+		rows[column] = [int(scale[value]) for value in rows[column]]
+		for i in range(size):
+			factor = rows[i][column]
+			if i != column and factor:
+				table = mul[factor]
+				rows[i] = [value ^ int(table[pivot_value]) for value, pivot_value in zip(rows[i], rows[column])]
+	return [row[size:] for row in rows]
+
+
+def decode(shards: dict, k: int, m: int, length: int) -> bytes:
+	"""
+	rebuilds a piece from any k of its shards
+	:param shards: dict of shard index -> shard
+	:param k: number of data shards
+	:param m: number of parity shards
+	:param length: piece length
+	:return: piece
+	"""
+	if len(shards) < k:
+		raise ValueError(f'{len(shards)} shards cannot rebuild a {k} + {m} code')
+	indexes = sorted(shards)[:k]
+
+	# only data shards, nothing to solve
+	if indexes == list(range(k)):
+		return b''.join(shards[index] for index in indexes)[:length]
+
+	np = _numpy()
+	rows = np.stack([np.frombuffer(shards[index], dtype=np.uint8) for index in indexes])
+	pairs = _pairs(rows)
+	matrix = _invert([_coefficients(k, m, index) for index in indexes])
+	return b''.join(_combine(coefficients, pairs) for coefficients in matrix)[:length]
@@ -0,0 +1,54 @@
+import time
+from collections import deque
+from datetime import datetime
+
+
+class EventQueue:
+	"""
+	log lines on their way from the network threads to the gui or the console. putting a line never
+	blocks and never touches tkinter, whoever shows them drains them in batches on its own schedule
+	"""
+	MAX_EVENTS = 10000  # lines kept while nobody drains them, the oldest are dropped first
+
+	def __init__(self, maxlen: int = MAX_EVENTS):
+		"""
+		init function
+		:param maxlen: max number of lines waiting to be drained
+		"""
+		self.events = deque(maxlen=maxlen)  # append and popleft are atomic, no lock needed
+
+	def put(self, text: str) -> None:
+		"""
+		queues a log line with the time it happened
+		:param text: text
+		:return: None
+		"""
+		self.events.append(f"({datetime.now().strftime('%H:%M:%S')}): " + text)
+
+	def drain(self, limit: int = None) -> list:
+		"""
+		takes the oldest lines off the queue
+		:param limit: max number of lines, None for all of them
+		:return: lines in the order they were put
+		"""
+		lines = []
+		while self.events and (limit is None or len(lines) < limit):
+			try:
+				lines.append(self.events.popleft())
+			except IndexError:  # drained by someone else meanwhile
+				break
+		return lines
+
+
+def echo(queue: EventQueue, delay: float) -> None:
+	"""
+	prints the lines of a queue forever, the console of the headless mode
+	:param queue: event queue
+	:param delay: seconds between batches
+	:return: None
+	"""
+	while True:
+		lines = queue.drain()
+		if lines:
+			print('\n'.join(lines), flush=True)
+		time.sleep(delay)
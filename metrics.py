@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# upper bounds in seconds of the histogram buckets, the last one catches everything
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, float('inf'))
+
+
+def _key(name: str, labels: dict) -> str:
+	"""
+	the prometheus name of a series
+	:param name: metric name
+	:param labels: label name -> value
+	:return: name{label="value",...}
+	"""
+	if not labels:
+		return name
+	return name + '{' + ','.join(f'{label}="{value}"' for label, value in sorted(labels.items())) + '}'
+
+
+class Registry:
+	"""
+	counters, gauges and histograms of one admin or peer. every update is a dict operation under a
+	lock so it can be called from any thread on the transfer path
+	"""
+
+	def __init__(self):
+		"""
+		init function
+		"""
+		self.lock = threading.Lock()
+		self.counters = defaultdict(float)  # (name, series) -> value
+		self.gauges = defaultdict(float)  # (name, series) -> value
+		self.histograms = dict()  # (name, series) -> [count per bucket..., sum]
+
+	def inc(self, name: str, value: float = 1, **labels) -> None:
+		"""
+		adds to a counter
+		:param name: metric name
+		:param value: amount
+		:param labels: labels of the series
+		:return: None
+		"""
+		with self.lock:
+			self.counters[name, _key(name, labels)] += value
+
+	def add(self, name: str, value: float, **labels) -> None:
+		"""
+		moves a gauge up or down
+		:param name: metric name
+		:param value: amount, negative to decrease
+		:param labels: labels of the series
+		:return: None
+		"""
+		with self.lock:
+			self.gauges[name, _key(name, labels)] += value
+
+	def observe(self, name: str, value: float, **labels) -> None:
+		"""
+		records a value in a histogram
+		:param name: metric name
+		:param value: value in seconds
+		:param labels: labels of the series
+		:return: None
+		"""
+		with self.lock:
+			histogram = self.histograms.setdefault((name, _key(name, labels)), [0] * len(BUCKETS) + [0.0])
+			for i, bound in enumerate(BUCKETS):
+				if value <= bound:
+					histogram[i] += 1
+					break
+			histogram[-1] += value
+
+	@contextmanager
+	def timer(self, name: str, **labels):
+		"""
+		records how long a block takes in a histogram
+		:param name: metric name
+		:param labels: labels of the series
+		"""
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(name, time.perf_counter() - start, **labels)
+
+	def snapshot(self) -> dict:
+		"""
+		a copy of every metric, the answer of the stats command
+		:return: {'counters': {series: value}, 'gauges': {series: value},
+		'histograms': {series: {'buckets': {upper bound: count}, 'sum': s, 'count': n}}}
+		"""
+		with self.lock:
+			histograms = {}
+			for (name, series), histogram in self.histograms.items():
+				histograms[series] = {'buckets': dict(zip(BUCKETS, histogram[:-1])),
+									  'sum': histogram[-1],
+									  'count': sum(histogram[:-1])}
+			return {'counters': {series: value for (name, series), value in self.counters.items()},
+					'gauges': {series: value for (name, series), value in self.gauges.items()},
+					'histograms': histograms}
+
+	def render(self) -> str:
+		"""
+		every metric in the prometheus text format
+		:return: text
+		"""
+		lines = []
+		with self.lock:
+			for kind, values in (('counter', self.counters), ('gauge', self.gauges)):
+				for name in sorted({name for name, _ in values}):
+					lines.append(f'# TYPE {name} {kind}')
+					lines.extend(f'{series} {value:g}' for (metric, series), value in sorted(values.items())
+								 if metric == name)
+
+			for name in sorted({name for name, _ in self.histograms}):
+				lines.append(f'# TYPE {name} histogram')
+				for (metric, series), histogram in sorted(self.histograms.items()):
+					if metric != name:
+						continue
+					labels = series[len(name):].strip('{}')
+					total = 0
+					for bound, count in zip(BUCKETS, histogram):
+						total += count
+						le = '+Inf' if bound == float('inf') else f'{bound:g}'
+						lines.append(f'{name}_bucket{{{labels + "," if labels else ""}le="{le}"}} {total}')
+					suffix = '{' + labels + '}' if labels else ''
+					lines.append(f'{name}_sum{suffix} {histogram[-1]:g}')
+					lines.append(f'{name}_count{suffix} {total}')
+		return '\n'.join(lines) + '\n'
+
+	def serve(self, port: int, host: str = '127.0.0.1') -> int:
+		"""
+		answers http requests with the metrics in the prometheus text format from a daemon thread
+		:param port: port to listen on, 0 for any free port
+		:param host: address to listen on, only this machine by default
+		:return: the port it listens on
+		"""
+		registry = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				body = registry.render().encode()
+				self.send_response(200)
+				self.send_header('Content-Type', 'text/plain; version=0.0.4')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				pass
+
+		server = ThreadingHTTPServer((host, port), Handler)
+		server.daemon_threads = True
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		return server.server_address[1]
@@ -1,14 +1,32 @@
+import hashlib
 import os
 import socket
+import sys
 import threading
-import sqlite3
-import pickle
 import time
 from math import floor
-import tkinter as tk
-from tkinter import filedialog
 # from tkinter import ttk
-from datetime import datetime
+from collections import defaultdict, deque
+from itertools import combinations
+from concurrent.futures import ThreadPoolExecutor
+
+import compression
+import connection
+import erasure
+import events
+import metrics
+import protocol
+import scheduler
+import segments
+import store
+import transfer
+import workers
+
+try:
+	import tkinter as tk
+	from tkinter import filedialog
+except ImportError:  # the headless mode runs without tkinter
+	tk = None
 
 #from admin import Admin
 
@@ -17,6 +35,28 @@ class Peer:
 	BUFSIZE = 1024 * 256
 	ADMIN_IP = '192.168.1.165' #Admin.IP
 	ADMIN_PORT = 8000 #Admin.PORT
+	UPLOAD_RATE = None  # upload cap in bytes per second, None for no cap
+	SEGMENTS_IN_FLIGHT = 8  # segments requested at the same time during a download
+	SEGMENTS_PER_PEER = 2  # segments requested from the same holder at the same time
+	SEGMENT_TIMEOUT = 60  # seconds to wait for a requested segment to arrive
+	ADMIN_TIMEOUT = 10  # seconds to wait for the admin to answer a request
+	PIECE_SIZE = 1024 * 1024  # files are cut into pieces of this many bytes, whatever the size of the network
+	ERASURE_CODING = False  # spread pieces as reed solomon shards instead of copies, needs numpy
+	HASH_WORKERS = os.cpu_count() or 1  # threads hashing pieces, hashlib releases the gil while it hashes
+	PREPARE_AHEAD = 2 * HASH_WORKERS  # pieces hashed and encoded ahead of the one being sent, bounds upload memory
+	COMPRESSION = None  # 'zlib' or 'lzma' to compress segments that compress well, on the wire and at rest
+	COMPRESSION_FAST = True  # the fastest level of the codec
+	METRICS_PORT = 0  # local port of the prometheus text endpoint, 0 for any free port, None to turn it off
+	UI_DELAY = 100  # milliseconds between two batches of log lines shown by the gui
+	UI_BATCH = 200  # max log lines shown at once, the rest wait for the next batch
+	SERVER_WORKERS = 32  # connections served at the same time
+	ACCEPT_QUEUE = 256  # accepted connections waiting for a worker, the rest wait in the listen backlog
+	BACKLOG = 1024  # connections the listening socket queues before they are accepted
+	UPLOAD_SLOTS = 4  # segments uploaded to requesters at the same time, the other requests wait for a slot
+	CONNECTION_TIMEOUT = 30  # seconds a connection may stay silent before it is dropped
+	CONNECT_TIMEOUT = 5  # seconds to wait for another peer to accept a connection
+	POOL_IDLE = 20  # seconds a connection to another peer is kept unused, below its CONNECTION_TIMEOUT
+	HEARTBEAT = 3  # seconds between two messages telling the admin this peer is alive
 
 	def __init__(self, user_hash):
 		"""
@@ -32,242 +72,248 @@ class Peer:
 
 		self.names = list()
 
-		self.gui = tuple()
+		# the catalog of file names and online peers is pushed by the admin, these tell what this peer has seen of it
+		self.catalog_epoch = None
+		self.catalog_version = None
+		self.catalog_resync = None  # request id of the subscribe still waiting for its reply, pushes wait for it
 
-		self.db = sqlite3.connect(f'{self.user_hash}.db', check_same_thread=False)
-		cur = self.db.cursor()
-		cur.execute(f"""CREATE TABLE IF NOT EXISTS {self.user_hash}(
-		           file_name TEXT,
-		           segment_index INT,
-		           max_index INT,
-		           data BLOB);
-		        """)
-		self.db.commit()
+		self.events = events.EventQueue()  # log lines for the gui or the console
 
-		self.data_list = list()
+		# counters and histograms of this peer, served by run_server and answered to the stats command
+		self.metrics = metrics.Registry()
 
-		self.temp = None  # general use var for global purposes
-		self.ack_flag = [False, False]
+		# segments this peer holds, kept as files and indexed in its database
+		self.store = store.SegmentStore(self.user_hash)
+
+		# persistent connections to other peers, segments are requested and pushed through them
+		self.connections = connection.ConnectionPool(Peer.CONNECT_TIMEOUT, Peer.POOL_IDLE)
+
+		# one persistent connection to the admin server, every request and response goes through it
+		self.admin = None
+		self.admin_lock = threading.Lock()
 
 		self.server_queue = list()
 		self.server_online = False
-		self.download_flag = False
+
+		# shared by every upload of this peer so the cap holds across parallel transfers
+		self.rate_limiter = transfer.RateLimiter(Peer.UPLOAD_RATE)
+
+		# upload load reported to the admin, which ranks the holders of a segment by it
+		self.uploads = 0  # segments being uploaded right now
+		self.upload_rate = None  # recent upload throughput in bytes per second
+		self.load_lock = threading.Lock()
+		# connection -> replies queued or being sent on it, the poller does not drop a connection that has any
+		self.replies = defaultdict(int)
+
+		# a bounded number of threads serves the connections and the uploads, whatever the number of requesters
+		self.server_pool = workers.WorkerPool(Peer.SERVER_WORKERS, Peer.ACCEPT_QUEUE, 'serve')
+		self.upload_pool = workers.WorkerPool(Peer.UPLOAD_SLOTS, name='upload')
+		# connections with nothing to read wait here instead of on a worker
+		self.poller = workers.Poller(Peer.CONNECTION_TIMEOUT)
 
 	@staticmethod
-	def divide_to_chunks(path: str, N: int) -> list:
+	def divide_to_pieces(path: str, piece_size: int) -> list:
 		"""
-		divide a file into N chunks of data
+		divide a file into pieces of a fixed size. nothing is read, a piece is only a range of the file
 		:param path: path of file
-		:param N: number of chunks
-		:return:
+		:param piece_size: length of every piece but the last
+		:return: list of (offset, length) tuples
 		"""
 		# Check if the file exists
 		if os.path.isfile(path):
-			# Open the file in binary mode
-			with open(path, 'rb') as file:
-				# Get the file size using the stat function
-				size = os.stat(file.fileno()).st_size
-				segments = []
-				for i in range(N):
-					segments.append(file.read(size // N)) if i < N - 1 else segments.append(file.read(size // N + N))
-
-			return segments
+			# Get the file size using the stat function
+			size = os.stat(path).st_size
+			# the last piece is shorter, an empty file still has one piece
+			return [(offset, min(piece_size, size - offset)) for offset in range(0, size, piece_size)] or [(0, 0)]
 		else:
 			raise FileExistsError("File doesn't exist")
 
 	@staticmethod
-	def divide_to_peers(path: str, N: int, M: int = 0.5) -> list:
+	def divide_to_peers(path: str, N: int, M: int = 0.5, erasure_coding: bool = False) -> list:
 		"""
-		creates a combination of segments to send to each peer in the network
+		creates a combination of segments to send to each peer in the network. the pieces do not depend on
+		the number of peers, only where they are placed does
 		:param path: path of file
 		:param N: number of connected peers
 		:param M: max part of peers that can crash
-		:return:
+		:param erasure_coding: cut every piece into reed solomon shards instead of copying it, one for every peer
+		up to erasure.MAX_SHARDS
+		:return: (list of segment indexes for each peer, list of (offset, length) pieces, (k, m) or None).
+		with replication a segment is a piece, with erasure coding segment p * (k + m) + i is shard i of piece p
 		"""
-		# divide the file into chunks
-		chunks = Peer.divide_to_chunks(path, N)
+		# divide the file into pieces
+		pieces = Peer.divide_to_pieces(path, Peer.PIECE_SIZE)
 		factor_of_freedom = floor(N // (1 / M) + 1)
 
-		# create the combination list of which segments to send to each peer
-		parts = []
-		for i in range(N):
-			combination = []
+		if erasure_coding:
+			# k data and m parity shards survive as many crashes as factor_of_freedom copies. the code has at most
+			# MAX_SHARDS shards, on a larger network the shards of every piece go to the next peers in turn
+			shards = min(N, erasure.MAX_SHARDS)
+			factor_of_freedom = floor(shards // (1 / M) + 1)
+			coding = (shards - factor_of_freedom + 1, factor_of_freedom - 1)
+			parts = [[] for _ in range(N)]
+			for segment in range(len(pieces) * shards):
+				parts[segment % N].append(segment)
+			return parts, pieces, coding
+
+		# every piece is placed on factor_of_freedom neighbouring peers
+		parts = [[] for _ in range(N)]
+		for index in range(len(pieces)):
 			for j in range(factor_of_freedom):
-				combination.append(chunks[(i + j) % N])
-			parts.append(combination)
+				parts[(index + j) % N].append(index)
 
-		return parts, chunks
+		return parts, pieces, None
 
-	def upload_to_db(self, name: str, index: int, max_index: int, data: bytes) -> None:
+	def user_upload(self, path: str) -> None:
 		"""
-		uploads a data segment to the database
-		:param name: file name
-		:param index: index of segment
-		:param max_index: highest segment number of og file
-		:param data: raw data
+		connects between the upload procedure (file_upload) and the gui or the console
+		:param path: file the user picked
 		:return: None
 		"""
-		cur = self.db.cursor()
-		cur.execute(f"INSERT INTO {self.user_hash} VALUES(?, ?, ?, ?);",
-					(name, index, max_index, data))
-		self.db.commit()
-
-	def search_for_parts(self, file_name: str, segment_index: int) -> list:
-		"""
-		queries for segments that match the file name and index
-		:param file_name: file name
-		:param segment_index: index of segment
-		:return: a list of all matches for the query
-		"""
-		# query for the all users that have a segment of a file
-		cur = self.db.cursor()
-		cur.execute(f"SELECT * FROM {self.user_hash} WHERE file_name = ? AND segment_index = ? AND data IS NOT NULL",
-					(file_name, segment_index))
-
-		return cur.fetchone()
-
-	def user_upload(self, delay: float = 0.1) -> None:
-		"""
-		connects between the upload procedure (file_upload) and the gui
-		:param delay: some time between sending packages
-		:return: None
-		"""
-		path = filedialog.askopenfilename()
-		if not path:
-			return
 		file_name = path.split('/')[-1]
 
 		# check compatibility
 
 		# say hello to admin
-		client_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		sendThis = {'user hash': self.user_hash,
-					'server sock': (self.server_sock.getsockname()[0], self.server_sock.getsockname()[1]),
-					'command': 'hello admin!'}
+		sendThis = self.admin_message('hello admin!')
 		try:
-			client_sock.connect((Peer.ADMIN_IP, Peer.ADMIN_PORT,))
+			self.admin_connection().send(sendThis)
 			self.server_online = True
-			client_sock.sendall(pickle.dumps(sendThis))
-			time.sleep(delay)
 		except:
 			self.server_online = False
 			self.server_queue.append(sendThis)
 
 		# get file names
-		item = tk.Listbox(self.gui[0], selectmode=tk.SINGLE).get(tk.ACTIVE)
-		items = self.gui[2].get(0, tk.END)
-		if item in items:
+		if file_name in self.names:
 			self.update_listboxes('You cannot upload a file with a name that already exists!')
 			return
 
 		# compatibility approved, upload the file
-		self.file_upload(client_sock, path)
-
-		client_sock.close()
+		self.file_upload(path)
 
 		# update gui
 		# self.names.append(file_name)
 
-	def user_download(self, selected_file: str, delay: float = 0.1) -> None:
+	def user_download(self, selected_file: str, dir: str) -> None:
 		"""
-		connects between the download procedure (file_download) and the gui
+		connects between the download procedure (file_download) and the gui or the console
 		:param selected_file: a file that is present in the database
-		:param delay: some time to wait between packages
+		:param dir: where to save the file
 		:return: None
 		"""
-		dir = filedialog.askdirectory()
-		if not dir:
-			return
-
 		# say hello to admin
-		sendThis = {'user hash': self.user_hash,
-					'server sock': (self.server_sock.getsockname()[0], self.server_sock.getsockname()[1]),
-					'command': 'hello admin!'}
+		sendThis = self.admin_message('hello admin!')
 		try:
-			client_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-			client_sock.connect((Peer.ADMIN_IP, Peer.ADMIN_PORT,))
+			self.admin_connection().send(sendThis)
 			self.server_online = True
 
-			client_sock.sendall(pickle.dumps(sendThis))
-			time.sleep(delay)
-
 			# download the file into dir
-			self.file_download(client_sock, selected_file, dir)
-
-			client_sock.close()
+			self.file_download(selected_file, dir)
 
 		except:
 			self.server_queue.append(sendThis)
 			self.server_online = False
 			self.update_listboxes('It is not possible to download a file without the management server online!')
 
-	def file_upload(self, client_sock: socket.socket, path: str, delay: float = 0.1) -> None:
+	def file_upload(self, path: str) -> None:
 		"""
 		the upload procedure. communicates with the admin server and other peers to upload the file to the network
-		:param client_sock: the client sock of the peer
 		:param path: path of desired file
-		:param delay: some time to wait between packages
 		:return: None
 		"""
 		try:
 			# upload procedure
 			file_name = path.split('/')[-1]
 
-			# split the file into N chunks and create combinations of the file
-			combination, chunks = Peer.divide_to_peers(path, len(self.online_peers.values()))
+			# split the file into pieces and create combinations of the file
+			combination, chunks, coding = Peer.divide_to_peers(path, len(self.online_peers.values()),
+																erasure_coding=Peer.ERASURE_CODING)
+			shards = sum(coding) if coding is not None else 1  # segments per piece
+			max_index = len(chunks) * shards - 1
+			file_size = os.stat(path).st_size
 			# print(self.server_online, self.online_peers)
-			# when having the list of online peers, begin to transmit the data one at the time
-			for peer, designated_segments in zip(self.online_peers.values(), combination):
-				tempSock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-				peer = tuple(peer)
-				try:
-					tempSock.connect(peer)
-				except Exception as e:
-					raise e
-					self.update_listboxes('Upload failed. Try again.')
-					return
-				# print(self.server_online)
-				for segment in designated_segments:
-					# signal server first
-					time.sleep(delay)
-					# print(('download', file_name, chunks.index(segment), len(self.online_peers) - 1))
-					tempSock.sendall(
-						pickle.dumps(('download', file_name, chunks.index(segment), len(self.online_peers) - 1)))
-
-					# start sending data
-					data = [segment[j:j + Peer.BUFSIZE - 100] for j in range(0, len(segment), Peer.BUFSIZE - 100)]
-					for index, c in enumerate(data):
-						time.sleep(delay)
-						# print(index, len(data))
-						tempSock.sendall(pickle.dumps((c, index != len(data) - 1)))  # update more flag
-
-				# close connection before opening a new one
-				tempSock.close()
+			# map the file once, every segment is sent straight from the mapping
+			with segments.FileSegments(path) as file:
+				# the layout is stored first so the segments are read correctly as soon as they are registered. the
+				# admin keeps the hash of every piece so downloads can verify them, they follow once they are known
+				manifest = {'file name': file_name, 'piece size': Peer.PIECE_SIZE, 'hashes': None, 'coding': coding}
+				self.request_admin('upload manifest', manifest)
+
+				# the peers every segment is placed on
+				targets = defaultdict(list)
+				for peer, designated_segments in zip(self.online_peers.values(), combination):
+					for index in designated_segments:
+						targets[index].append(peer)
+
+				def prepare(piece: int) -> tuple:
+					# hashes a piece and encodes, compresses and hashes its segments, once for all of their peers
+					view = file.view(*chunks[piece])
+					piece_hash = hashlib.sha1(view).digest()
+					prepared = []
+					for index in range(piece * shards, (piece + 1) * shards):
+						if index not in targets:
+							continue
+						data, digest = view, piece_hash
+						if coding is not None:
+							data = erasure.encode(view, *coding, index % shards)
+							digest = hashlib.sha1(data).digest()
+
+						# segments that compress well are sent and kept compressed
+						codec, data = compression.compress(data, Peer.COMPRESSION, Peer.COMPRESSION_FAST)
+						if codec is not None:
+							digest = hashlib.sha1(data).digest()
+						prepared.append((index, codec, data, digest))
+					return piece, piece_hash, prepared
+
+				hashes = [None] * len(chunks)
+				acks = []
+
+				def send_piece(piece: int, piece_hash: bytes, prepared: list) -> None:
+					hashes[piece] = piece_hash
+					for index, codec, data, digest in prepared:
+						for peer in targets[index]:
+							conn = self.connections.get(peer)
+							# signal server first, with the digest the receiver checks the segment against and its
+							# codec, then send the data as one frame, the receiver rebuilds it no matter how tcp
+							# splits it
+							request_id, future = conn.pending.register()
+							conn.send_data(('download', file_name, index, max_index, file_size, digest, codec), data,
+										   request_id, self.rate_limiter)
+							self.metrics.inc('peer_bytes_sent_total', len(data), kind='upload')
+							acks.append((conn, request_id, future))
+
+				# the pieces are prepared on every core a few ahead of the one being sent, so the file is read once
+				# and hashing overlaps the network
+				with ThreadPoolExecutor(Peer.HASH_WORKERS) as pool:
+					ahead = deque()
+					for piece in range(len(chunks)):
+						ahead.append(pool.submit(prepare, piece))
+						if len(ahead) > Peer.PREPARE_AHEAD:
+							send_piece(*ahead.popleft().result())
+					while ahead:
+						send_piece(*ahead.popleft().result())
+
+				manifest['hashes'] = b''.join(hashes)
+				self.request_admin('upload manifest', manifest)
+
+				# wait until the peers stored every segment, a corrupted one closes the connection
+				for conn, request_id, future in acks:
+					conn.pending.wait(request_id, future, transfer.ACK_TIMEOUT)
 		except (OSError, ConnectionError, ConnectionResetError, Exception) as e:
 			raise e
 
-	def file_download(self, client_sock: socket.socket, file_name: str, dir: str, delay: float = 0.07) -> None:
+	def file_download(self, file_name: str, dir: str) -> None:
 		"""
 		the download procedure. communicates with the admin server and other peers to download the file from the network
-		:param client_sock: the client sock of the peer
 		:param file_name: file name
 		:param dir: where to save the file once obtained
-		:param delay: some time to wait between packages
 		:return: None
 		"""
 		try:
 			# download procedure
-			time.sleep(delay)
-
 			'''
 			# get file names
-			self.names = [0]
-			sendThis = {'user hash': self.user_hash,
-						'server sock': (self.server_sock.getsockname()[0], self.server_sock.getsockname()[1]),
-						'command': 'get file names'}
-			client_sock.sendall(pickle.dumps(sendThis))
-			while self.names == [0]:  # wait until received
-				pass
+			self.names = self.request_admin('get file names')
 
 			if file_name not in self.names:
 				self.update_listboxes('File is not in database. Try another one.')
@@ -275,60 +321,122 @@ class Peer:
 			'''
 
 			# if exists, request the references of the file
-			self.temp = [0]
-			sendThis = {'user hash': self.user_hash,
-						'server sock': (self.server_sock.getsockname()[0], self.server_sock.getsockname()[1]),
-						'command': 'request file',
-						'data':
-							{'file name': file_name}
-						}
-			client_sock.sendall(pickle.dumps(sendThis))
-
-			i = 0
-			while self.temp == [0]:  # wait until received
-				i += 1
-				if i > 10000000:
-					raise ConnectionError
-			self.data_list = [None] * len(self.temp)
-			self.download_flag = False
-			for i, reference in enumerate(self.temp):
+			started = time.perf_counter()
+			references = self.request_admin('request file', {'file name': file_name})
+			# (file name, index, max index, addr, file size, piece size, piece hash, (k, m) or None, ranked addrs)
+			file_size, piece_size, coding = references[0][4], references[0][5], references[0][7]
+
+			k, m = coding if coding is not None else (1, 0)  # a copied piece is a single shard
+			count = (references[0][2] + 1) // (k + m)
+
+			# pieces saved by an interrupted download of the same file are not requested again
+			path = str(dir + '/' + file_name)
+			done = self.store.start_download(path, file_name, file_size, piece_size, count)
+
+			# any k shards of a piece rebuild it, the rest are spares in case a holder fails
+			shards = defaultdict(list)
+			for reference in references:
 				# print(reference)
+				if reference[1] // (k + m) not in done:
+					shards[reference[1] // (k + m)].append(reference)
 
-				file_name, index, max_index, addr = reference  # (file name, index, max index, addr)
+			# check for a missing piece, which means the admin database is corrupted or everyone is offline
+			if len(shards) != count - len(done) or min(map(len, shards.values()), default=k) < k:
+				self.update_listboxes(
+					'The database did not contain a suitable address of a segment and therefore it is unreachable. Download failed.')
+				return
+			wanted = [reference for piece in shards.values() for reference in piece[:k]]
+			spares = {piece: piece_shards[k:] for piece, piece_shards in shards.items()}
+			received = defaultdict(dict)  # piece -> {shard index: data}, kept until the piece is written
+			decoded = set()  # pieces written
+			lock = threading.Lock()
+
+			# every segment is written to its offset as soon as it arrives and recorded once it is there
+			writer = segments.DownloadWriter(path, file_size, count, piece_size, resume=bool(done),
+											 on_write=lambda index: self.store.mark_piece(path, index), written=done)
+
+			def verify(reference: tuple, data) -> None:
+				# files from before the manifests have no hashes to check
+				if reference[6] is not None and hashlib.sha1(data).digest() != reference[6]:
+					raise ConnectionError(f'Segment {reference[1]} of {reference[0]} failed verification')
+
+			def fetch(reference: tuple, addr: tuple) -> None:
+				data = self.request_segment(reference, addr)
+				verify(reference, data)
+				writer.write(reference[1], data)
+
+			def holders(reference: tuple) -> list:
+				# every online holder, the least loaded first
+				return [tuple(addr) for addr in reference[8]]
+
+			def fetch_spare(piece: int, error: Exception) -> tuple:
+				# the next spare shard of a piece, the error is raised once there are none left
+				with lock:
+					if not spares[piece]:
+						raise error
+					reference = spares[piece].pop(0)
+				return reference, tuple(reference[3])
+
+			def fetch_shard(reference: tuple, addr: tuple) -> None:
+				piece = reference[1] // (k + m)
+				length = min(piece_size, file_size - piece * piece_size)
+				while True:
+					try:
+						data = self.request_segment(reference, addr)
+					except OSError as e:
+						# ask a spare holder of the same piece instead
+						reference, addr = fetch_spare(piece, e)
+						continue
+
+					with lock:
+						if piece in decoded:
+							return
+						received[piece][reference[1] % (k + m)] = data
+						if len(received[piece]) < k:  # the fetches of the other shards complete the piece
+							return
+						piece_shards = dict(received[piece])
+
+					# any k shards rebuild the piece, a corrupted one is left out by trying the other sets
+					error = None
+					for indexes in combinations(sorted(piece_shards), k):
+						data = erasure.decode({i: piece_shards[i] for i in indexes}, k, m, length)
+						try:
+							verify(reference, data)
+						except ConnectionError as e:
+							error = e
+							continue
+						with lock:
+							if piece in decoded:
+								return
+							decoded.add(piece)
+							received.pop(piece, None)
+						writer.write(piece, data)
+						return
+
+					# no set of the shards so far is good, one more shard gives new sets to try
+					reference, addr = fetch_spare(piece, error)
+
+			# request the segments from their holders, several at a time
+			try:
+				scheduler.DownloadScheduler(fetch if coding is None else fetch_shard, holders,
+											Peer.SEGMENTS_IN_FLIGHT, Peer.SEGMENTS_PER_PEER).run(wanted)
+			except ConnectionError as e:  # if socket is offline or something else happened
+				writer.close()
+				self.update_listboxes('Download failed. There is no peer with the data. Resume it once they are back.')
+				return
+			except Exception:
+				writer.close()
+				raise
 
-				# check for a missing index, which means the admin database is corrupted or everyone is offline
-				if i != index:
-					self.update_listboxes(
-						'The database did not contain a suitable address of a segment and therefore it is unreachable. Download failed.')
-					return
-				tempSock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-				addr = tuple(addr)
-				try:  # if socket is offline or something else happened
-					tempSock.connect(addr)
-				except Exception as e:
-					self.update_listboxes('Download failed. There is no peer with the data.')
-					return
-				time.sleep(delay)
-				tempSock.sendall(
-					pickle.dumps(('upload to', (self.server_sock.getsockname()[0], self.server_sock.getsockname()[1]),
-								  file_name, index, max_index)))
-
-				# close connection
-				tempSock.close()
-
-			while not self.download_flag:
-				# print(list(map(lambda x: 0 if x is not None else None, self.data_list))) # debug
-				pass
-			self.download_flag = False
-			# arrange and merge
-			file_data = b''
-			for n in self.data_list:
-				# print(len(n)) # debug
-				file_data += n
 			# save file
-			path = str(dir + '/' + file_name)
-			with open(path, "wb") as file:
-				file.write(file_data)
+			try:
+				writer.commit()
+			except ValueError as e:
+				writer.close()
+				self.update_listboxes(f'Download failed. {e}. Resume it to request them again.')
+				return
+			self.store.finish_download(path)
+			self.metrics.observe('peer_download_seconds', time.perf_counter() - started)
 
 			self.update_listboxes(f'Download was successful. File saved at {path}')
 
@@ -337,178 +445,329 @@ class Peer:
 			self.update_listboxes('Download failed. Could not retrieve the file.')
 			return
 
-	def handle_client(self, conn: socket.socket, addr: tuple, delay: float = 0.1) -> None:
+	def resume_downloads(self) -> None:
+		"""
+		lists the downloads that were interrupted and resumes them one at a time
+		:return: None
+		"""
+		downloads = self.store.incomplete_downloads()
+		if not downloads:
+			self.update_listboxes('There are no incomplete downloads.')
+			return
+
+		for file_name, path, done, count in downloads:
+			self.update_listboxes(f'Resuming {file_name}, {done} of {count} pieces are saved at {path}')
+			self.file_download(file_name, os.path.dirname(path))
+
+	def request_segment(self, reference: tuple, addr: tuple) -> bytes:
+		"""
+		asks a holder for a segment on the persistent connection to it and waits until it arrives
+		:param reference: (file name, index, max index, addr, file size, piece size, piece hash, (k, m) or None,
+		ranked addrs)
+		:param addr: address of the holder's server socket (ip, port)
+		:return: segment data
+		"""
+		file_name, index, max_index = reference[:3]
+		start = time.perf_counter()
+		try:
+			# the segment follows right behind the command announcing it, its arrival is the time to first byte
+			first_byte = lambda header: self.metrics.observe('peer_first_byte_seconds', time.perf_counter() - start)
+			header, payload = self.connections.get(addr).request_data(('send segment', file_name, index),
+																	  Peer.SEGMENT_TIMEOUT, first_byte)
+			self.metrics.inc('peer_bytes_received_total', len(payload), kind='download')
+			try:
+				data = compression.decompress(payload, header[4])
+			except ValueError as e:  # ask another holder
+				raise ConnectionError(e)
+		except Exception:
+			self.metrics.inc('peer_segments_total', result='failed')
+			raise
+
+		self.metrics.inc('peer_segments_total', result='ok')
+		self.metrics.observe('peer_segment_seconds', time.perf_counter() - start)
+		self.update_listboxes(f'Received a data segment: {(file_name, index, max_index)}')
+		return data
+
+	def admin_connection(self) -> connection.Connection:
+		"""
+		the persistent connection to the admin server, reconnected if it was lost
+		:return: Connection object
+		"""
+		with self.admin_lock:
+			if self.admin is None or self.admin.closed:
+				self.admin = connection.Connection((Peer.ADMIN_IP, Peer.ADMIN_PORT), on_message=self.on_admin_message,
+												   timeout=Peer.ADMIN_TIMEOUT)
+				# catch up with the catalog from the version seen last and get its changes pushed from now on
+				self.subscribe(self.admin)
+			return self.admin
+
+	def subscribe(self, admin: connection.Connection) -> None:
+		"""
+		asks the admin for the catalog changes after the version this peer has, on a connection. the changes
+		pushed until its reply arrives are ignored, the reply covers them
+		:param admin: connection to the admin
+		:return: None
+		"""
+		self.catalog_resync = protocol.next_request_id()
+		admin.send(self.admin_message('subscribe', {'epoch': self.catalog_epoch, 'version': self.catalog_version}),
+				   self.catalog_resync)
+
+	def on_admin_message(self, request_id: int, message: tuple) -> None:
+		"""
+		applies the catalog pushed by the admin. runs on the reader thread of the admin connection, so the
+		messages are applied in the order they were sent. names and online_peers are replaced, not changed, so
+		they can be read from any thread
+		:param request_id: request id of the subscribe for its reply, 0 for pushed messages
+		:param message: ('catalog', version, {epoch, files, peers}) or ('catalog delta', version, changes)
+		:return: None
+		"""
+		if self.catalog_resync is not None:
+			if request_id != self.catalog_resync:  # pushed before the reply
+				return
+			self.catalog_resync = None
+
+		if message[0] == 'catalog':  # the whole catalog
+			self.names = list(message[2]['files'])
+			self.online_peers = dict(message[2]['peers'])
+			self.catalog_epoch, self.catalog_version = message[2]['epoch'], message[1]
+
+		elif message[0] == 'catalog delta' and self.catalog_version is not None:
+			names, online_peers = list(self.names), dict(self.online_peers)
+			for version, kind, data in message[2]:
+				if version <= self.catalog_version:  # seen already
+					continue
+				if version != self.catalog_version + 1:  # missed a change, start over from the last one seen
+					self.subscribe(self.admin)
+					break
+				if kind == 'file added' and data not in names:
+					names.append(data)
+				elif kind == 'peer online':
+					online_peers[data[0]] = data[1]
+				elif kind == 'peer offline':
+					online_peers.pop(data, None)
+				self.catalog_version = version
+			self.names, self.online_peers = names, online_peers
+
+	def admin_message(self, command: str, data: dict = None) -> dict:
+		"""
+		builds a message for the admin server
+		:param command: admin command
+		:param data: optional command data
+		:return: message dict
+		"""
+		sendThis = {'user hash': self.user_hash,
+					'server sock': (self.server_sock.getsockname()[0], self.server_sock.getsockname()[1]),
+					'command': command,
+					'load': {'uploads': self.uploads + self.upload_pool.pending(), 'rate': self.upload_rate}}
+		if data is not None:
+			sendThis['data'] = data
+		return sendThis
+
+	def request_admin(self, command: str, data: dict = None):
 		"""
-		a thread to handle one connection as part of the peer server side
-		:param delay: delay time
+		sends a request to the admin server and waits for the response on the same connection
+		:param command: admin command
+		:param data: optional command data
+		:return: the response
+		"""
+		response = self.admin_connection().request(self.admin_message(command, data), Peer.ADMIN_TIMEOUT)
+		if response[0] == 'request failed':  # the admin could not answer the request
+			raise ConnectionError(response[2])
+		return response[2]
+
+	def handle_client(self, conn: socket.socket, addr: tuple, reader: protocol.FrameReader = None,
+					  send_lock: threading.Lock = None) -> None:
+		"""
+		handles the frames of one connection as part of the peer server side, runs on a worker of the server pool.
+		once the connection has nothing more to read it waits in the poller without a worker and comes back when
+		it is readable again
 		:param conn: socket object
 		:param addr: address (ip, port)
+		:param reader: frame reader of the connection, None for a new connection
+		:param send_lock: held while a reply is sent on the connection, None for a new connection
 		:return: None
 		"""
+		if reader is None:  # new connection
+			conn.settimeout(Peer.CONNECTION_TIMEOUT)
+			reader = protocol.FrameReader(conn, Peer.BUFSIZE)
+			send_lock = threading.Lock()
+			self.metrics.add('peer_connections', 1)
+
 		download_blocking = False
-		upload_blocking = False
-		name, index, max_index, file_data = None, None, None, None
+		name, index, max_index, file_size, digest, codec = None, None, None, None, None, None
 
-		#try:
-		while True:
-			data = conn.recv(Peer.BUFSIZE)
+		def resume() -> None:
+			# runs on the poller thread, which must never block. the connection was let in already
+			self.server_pool.submit(self.handle_client, conn, addr, reader, send_lock, wait=False)
 
-			if data:
-				# handle data
-				# print(data)
-				data = pickle.loads(data)
-				# print(data)
+		def drop() -> None:
+			conn.close()
+			self.metrics.add('peer_connections', -1)
 
-				if download_blocking:  # in the middle of file download transmission
-					# print(data[1])
-					if not data[1]:  # no more segments
-						file_data += data[0]
-						download_blocking = False
-						# print(len(file_data))
-						self.upload_to_db(name, index, max_index, file_data)
-						self.update_listboxes(f'Received a data segment: {(name, index, max_index)}')
-
-						# update admin server
-						sendThis = {'user hash': self.user_hash,
-									'server sock': (
-									self.server_sock.getsockname()[0], self.server_sock.getsockname()[1]),
-									'command': 'uploaded segment',
-									'data':
-										{'file name': name,
-										 'index': index,
-										 'max index': max_index,
-										 'user hash': self.user_hash}
-									}
-						if self.server_online:
-							time.sleep(delay)
-							tempSock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-							tempSock.connect((Peer.ADMIN_IP, Peer.ADMIN_PORT,))
-							tempSock.sendall(pickle.dumps(sendThis))
-							tempSock.close()
-							time.sleep(delay)
-						else:
-							self.server_queue.append(sendThis)
-
-					else:  # add to data and wait for more
-						file_data += data[0]
+		def busy() -> bool:
+			return conn in self.replies
+
+		handled = False
+		try:
+			while True:
+				if handled and not download_blocking and not reader.buffer:
+					# nothing to read right now, give the worker back
+					self.poller.register(conn, resume, drop, busy)
+					return
+				handled = True
+
+				header = reader.read_header()
+				if header is None:  # connection closed
+					break
+
+				# handle data
+				msg_type, request_id, length = header
+
+				if msg_type == protocol.DATA and download_blocking:  # the segment announced by the last 'download' command
+					download_blocking = False
+					self.metrics.inc('peer_bytes_received_total', length, kind='store')
+					# stream the segment from the socket into the store
+					if not self.store.receive(reader, length, name, index, max_index, digest, codec):
+						# not acknowledged, the uploader learns it from the closed connection
+						self.update_listboxes(f'Received a corrupted data segment: {(name, index, max_index)}')
+						break
+					with send_lock:
+						protocol.send_ack(conn, request_id)
+					self.update_listboxes(f'Received a data segment: {(name, index, max_index)}')
+
+					# update admin server
+					sendThis = self.admin_message('uploaded segment',
+												  {'file name': name,
+												   'index': index,
+												   'max index': max_index,
+												   'file size': file_size,
+												   'user hash': self.user_hash})
+					try:
+						if not self.server_online:
+							raise ConnectionError
+						self.admin_connection().send(sendThis)
+					except OSError:
+						self.server_queue.append(sendThis)
 					continue
 
-				if upload_blocking:
-					# print(data[1])
-					if not data[1]:  # no more segments
-						file_data += data[0]
-						self.data_list[index] = file_data
-						upload_blocking = False
-						self.download_flag = True
-						self.update_listboxes(f'Received a data segment: {(name, index, max_index)}')
-
-					else:  # add to data and wait for more
-						file_data += data[0]
+				payload = reader.read_payload(length)
+				if msg_type != protocol.COMMAND:
 					continue
 
+				data = protocol.decode_command(payload)
+				# print(data)
+
 				# struct = (command: str, server sock: (ip, port), data: {} or []) : tuple
 				if data[0] == 'download':  # preparing for downloading something
-					name, index, max_index = data[1:]
-					file_data = b''
+					name, index, max_index, file_size, digest, codec = data[1:]
 					download_blocking = True
 
-				elif data[0] == 'prepare for data requested':  # preparing to upload something to someone
-					name, index, max_index = data[1:]
-					file_data = b''
-					upload_blocking = True
-					self.download_flag = False
-
-				elif data[0] == 'upload to':  # start a thread to upload a segment to someone
-					# upload the file from db
-					file = self.search_for_parts(data[2], data[3])
-					name, index, max_index = data[2:]
-					# send the data to the specified address
-					threading.Thread(target=self.send_segment, args=(file, data[1],)).start()
-
-				elif data[0] == 'update online peers':
-					self.online_peers = data[2]
-
-				elif data[0] == 'distinct names':
-					self.names = data[2]
-
-				elif data[0] == 'file references':
-					self.temp = data[2]
-
-		'''except Exception as e:
-			print(data)
-			raise e
-			conn.close()
-			return'''
-
-	def send_segment(self, file: tuple, addr: tuple, delay: float = 0.07, iteration: bool = False) -> None:
+				elif data[0] == 'send segment':  # upload a segment back on this connection
+					file = self.store.find(data[1], data[2])
+					if file is None:
+						with send_lock:
+							protocol.send_command(conn, ('request failed', 0, f'No segment {data[2]} of {data[1]}'),
+												  request_id)
+					else:
+						# once an upload slot is free
+						with self.load_lock:
+							self.replies[conn] += 1
+						self.upload_pool.submit(self.send_segment, file, conn, send_lock, request_id, time.perf_counter())
+
+				elif data[0] == 'stats':  # answer with the metrics of this peer
+					with send_lock:
+						protocol.send_command(conn, ('stats', 0, self.metrics.snapshot()), request_id)
+
+		except OSError:  # the connection was dropped or stayed silent for too long
+			pass
+		except Exception as e:  # a malformed command, nothing more on this connection can be trusted
+			self.update_listboxes(f'Dropped the connection from {addr}: {e!r}')
+		drop()
+
+	def send_segment(self, file: tuple, conn: socket.socket, send_lock: threading.Lock, request_id: int,
+					 requested: float = None) -> None:
 		"""
-		often the segments will be larger that the buffer size so this function chops it to chunks and sends every one of them
-		:param iteration: is second iteration?
-		:param file: file name
-		:param addr: address of peers server socket (ip, port)
-		:param delay: some time to wait between packages
-		:return: None
+		sends a stored segment to the peer who requested it, on the connection the request came on
+		:param file: (file name, index, max index, path, codec) from the segment store
+		:param conn: socket of the connection the request came on
+		:param send_lock: held while a reply is sent on the connection
+		:param request_id: request id of the requester
+		:param requested: time.perf_counter() of the request, None if it was not queued
+		:return: None, the reply is taken off the replies of the connection once it is over
 		"""
-		tempSock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		addr = tuple(addr)
 		try:
-			file_data = bytearray(file[3])
-		except:
-			# tempSock.send(pickle.dumps('Could not retrieve the file from database'))
-			return
-
-		tempSock.connect(addr)
-		# notify server
-		tempSock.sendall(pickle.dumps(('prepare for data requested', file[0], file[1], file[2])))
-		time.sleep(delay)
-
-		# start sending data
-		data = [file_data[j:j + Peer.BUFSIZE - 100] for j in range(0, len(file_data), Peer.BUFSIZE - 100)]
-		for i, chunk in enumerate(data):
-			time.sleep(delay)
-			# tempSock.sendall(pickle.dumps((str(str(file[4]) + str(i)), chunk)))  # debug
-			# print(i, len(data))
-			tempSock.sendall(pickle.dumps((chunk, i != len(data) - 1)))  # update more flag
+			if requested is not None and time.perf_counter() - requested > Peer.SEGMENT_TIMEOUT:
+				return  # waited for a slot so long that the requester asked another holder
 
-		time.sleep(delay)
-		time.sleep(delay)
-
-		tempSock.close()
+			with self.load_lock:
+				self.uploads += 1
+			start = time.perf_counter()
+			try:
+				# announce the segment and its codec, then send it straight from the segment file to the socket. tcp
+				# delivers it, the requester does not acknowledge it
+				with send_lock:
+					protocol.send_command(conn, ('prepare for data requested', file[0], file[1], file[2], file[4]),
+										  request_id)
+					transfer.send_file(conn, file[3], request_id, self.rate_limiter)
+			except (OSError, ValueError):  # the requester is gone, the socket may be closed already
+				return
+			finally:
+				with self.load_lock:
+					self.uploads -= 1
+		finally:
+			with self.load_lock:
+				self.replies[conn] -= 1
+				if not self.replies[conn]:
+					del self.replies[conn]
+
+		# moving average of the throughput of single uploads
+		size = os.path.getsize(file[3])
+		elapsed = time.perf_counter() - start
+		self.metrics.inc('peer_bytes_sent_total', size, kind='serve')
+		self.metrics.observe('peer_serve_seconds', elapsed)
+		rate = size / max(elapsed, 1e-6)
+		with self.load_lock:
+			self.upload_rate = rate if self.upload_rate is None else 0.8 * self.upload_rate + 0.2 * rate
 
 	def run_server(self) -> None:
 		"""
 		the main loop of the peer's server side
 		:return: None
 		"""
+		# expose the metrics on this machine
+		if Peer.METRICS_PORT is not None:
+			try:
+				port = self.metrics.serve(Peer.METRICS_PORT)
+				self.update_listboxes(f'Metrics are served at http://127.0.0.1:{port}/metrics')
+			except OSError:
+				self.update_listboxes(f'Could not serve metrics on port {Peer.METRICS_PORT}')
+
 		while True:
 			try:
 				# bind server
 				self.update_listboxes(
 					f"server bound at ({self.server_sock.getsockname()[0]} , {self.server_sock.getsockname()[1]})")
 
+				# listen for incoming connections
+				self.server_sock.listen(Peer.BACKLOG)
 				while True:
-					# listen for an incoming connection
-					self.server_sock.listen()
 					# accept incoming connection
 					conn, addr = self.server_sock.accept()
 					# self.update_listboxes(f'New connection from {addr}') # debug
 
-					threading.Thread(target=self.handle_client, daemon=True, args=(conn, addr,)).start()
+					# blocks while the accept queue is full, new connections wait in the listen backlog meanwhile
+					self.server_pool.submit(self.handle_client, conn, addr)
 
 			except Exception as e:
 				continue
 
 	def update_listboxes(self, text: str) -> None:
 		"""
-		updates the log list box
-		:param text: text to add to the list box
+		queues a line for the log. never blocks, the gui or the console shows it later
+		:param text: text to add to the log
 		:return: None
 		"""
-		# update values of left
-		text = str(f"({datetime.now().strftime('%H:%M:%S')}): " + text)
-		self.gui[1].insert("end", text)
-		self.gui[1].see(tk.END)
-		self.gui[0].update()
+		self.events.put(text)
 
 
 def main(peer: Peer) -> None:
@@ -549,87 +808,143 @@ def main(peer: Peer) -> None:
 	# create left button
 	left_button = tk.Button(root, text="Upload", bg="#6340F3", font=('Calibri', 18, 'bold'),
 							fg="#F9F9F9",
-							command=lambda: threading.Thread(target=peer.user_upload, daemon=True).start())
+							command=lambda: ask_upload(peer))
 	left_button.grid(row=6, column=2, rowspan=1, columnspan=1, padx=10, pady=10, sticky="news")
 
 	# create right button
 	right_button = tk.Button(root, text="Download", bg="#6340F3", font=('Calibri', 18, 'bold'),
-							 fg="#F9F9F9", command=lambda: threading.Thread(target=handle_button_click,
-																			args=(peer, right_listbox)).start())
+							 fg="#F9F9F9", command=lambda: handle_button_click(peer, right_listbox))
 	right_button.grid(row=6, column=5, rowspan=1, columnspan=1, padx=10, pady=10, sticky="news")
 
+	# create middle button
+	middle_button = tk.Button(root, text="Resume", bg="#6340F3", font=('Calibri', 18, 'bold'),
+							  fg="#F9F9F9",
+							  command=lambda: threading.Thread(target=peer.resume_downloads, daemon=True).start())
+	middle_button.grid(row=6, column=3, rowspan=1, columnspan=1, padx=10, pady=10, sticky="news")
+
 	# make resizes look good
 	for i in range(6):
 		root.columnconfigure(i, weight=1)
 	for i in range(11):
 		root.rowconfigure(i, weight=1)
 
-	peer.gui = (root, left_listbox, right_listbox)
+	# list the downloads that were interrupted last time
+	for file_name, path, done, count in peer.store.incomplete_downloads():
+		peer.update_listboxes(f'{file_name} was not fully downloaded ({done} of {count} pieces). Press Resume to finish it.')
 
 	threading.Thread(target=peer.run_server, daemon=True).start()
-	threading.Thread(target=get_names, args=(peer, root, right_listbox)).start()
+	threading.Thread(target=keep_alive, daemon=True, args=(peer,)).start()
+
+	# the network threads only queue what happened, the gui thread shows it in batches
+	show_events(peer, root, left_listbox, right_listbox)
 
 	root.mainloop()
 
 
-def get_names(peer: Peer, root: tk.Tk, right_listbox) -> None:
+def show_events(peer: Peer, root, log_listbox, files_listbox) -> None:
 	"""
-	keeps a live communication with the admin server to spot file uploads and change the right list box
+	shows the log lines queued since the last call and the file names if they changed, then calls itself
+	again on the gui thread
 	:param peer: Peer instance
 	:param root: window object
-	:param right_listbox: listbox object
+	:param log_listbox: list box of the log
+	:param files_listbox: list box of the file names
 	:return: None
 	"""
+	lines = peer.events.drain(Peer.UI_BATCH)
+	if lines:
+		log_listbox.insert("end", *lines)
+		log_listbox.see(tk.END)
+
+	names = peer.names
+	if list(files_listbox.get(1, tk.END)) != names:
+		files_listbox.delete(1, tk.END)
+		files_listbox.insert("end", *names)
+	root.after(Peer.UI_DELAY, show_events, peer, root, log_listbox, files_listbox)
+
+
+def main_headless(peer: Peer) -> None:
+	"""
+	runs the peer without a gui. the log is printed and commands are read from the standard input:
+	files, upload <path>, download <file name> <dir>, resume. stops on ctrl+c
+	:param peer: Peer instance
+	:return: None
+	"""
+	threading.Thread(target=peer.run_server, daemon=True).start()
+	threading.Thread(target=keep_alive, daemon=True, args=(peer,)).start()
+	threading.Thread(target=events.echo, daemon=True, args=(peer.events, Peer.UI_DELAY / 1000)).start()
+
+	# list the downloads that were interrupted last time
+	for file_name, path, done, count in peer.store.incomplete_downloads():
+		peer.update_listboxes(f'{file_name} was not fully downloaded ({done} of {count} pieces). Type resume to finish it.')
+
 	try:
-		noted = False
-		while True:
-			# get files names
-			try:
-				sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-				sock.connect((Peer.ADMIN_IP, Peer.ADMIN_PORT,))
-				peer.server_online = True
-				noted = False
-
-				# update the admin with what happened while it was offline
-				time.sleep(0.1)
-				if peer.server_queue:
-					sock.sendall(pickle.dumps(peer.server_queue.pop(0)))
-
-				sendThis = {'user hash': peer.user_hash,
-							'server sock': (peer.server_sock.getsockname()[0], peer.server_sock.getsockname()[1]),
-							'command': 'get file names'}
-				sock.sendall(pickle.dumps(sendThis))
-				time.sleep(0.1)
-				sendThis = {'user hash': peer.user_hash,
-							'server sock': (peer.server_sock.getsockname()[0], peer.server_sock.getsockname()[1]),
-							'command': 'get online peers'}
-				sock.sendall(pickle.dumps(sendThis))
-
-			except (ConnectionError, ConnectionResetError, OSError) as e:
-				peer.server_online = False
-				if not noted:
-					peer.update_listboxes('The connection with admin server was terminated unexpectedly.')
-					noted = True
+		for line in sys.stdin:
+			command, _, argument = line.strip().partition(' ')
+			if command == 'files':
+				peer.update_listboxes('Files: ' + ', '.join(peer.names))
+			elif command == 'upload' and argument:
+				threading.Thread(target=peer.user_upload, daemon=True, args=(argument,)).start()
+			elif command == 'download' and ' ' in argument:
+				file_name, dir = argument.rsplit(' ', 1)
+				threading.Thread(target=peer.user_download, daemon=True, args=(file_name, dir)).start()
+			elif command == 'resume':
+				threading.Thread(target=peer.resume_downloads, daemon=True).start()
+			elif command:
+				peer.update_listboxes('Commands: files, upload <path>, download <file name> <dir>, resume')
+
+		# no console to read from, keep serving
+		threading.Event().wait()
+	except KeyboardInterrupt:
+		pass
 
-			finally:
-				items = [right_listbox.get(index) for index in range(right_listbox.size())]
-				if list(filter(lambda x: x not in items, peer.names)):
-					root.after(500, lambda: right_listbox.delete(1, tk.END))
-					root.after(500, lambda: [right_listbox.insert("end", name) for name in peer.names])
-					root.update()
-				time.sleep(2)
 
+def keep_alive(peer: Peer) -> None:
+	"""
+	keeps a live communication with the admin server. the admin pushes the file names and online peers on the same
+	connection, this only tells it the peer is alive and reconnects when it was lost
+	:param peer: Peer instance
+	:return: None
+	"""
+	noted = False
+	while True:
+		try:
+			# a new connection subscribes to the catalog again
+			admin = peer.admin_connection()
+			peer.server_online = True
+			noted = False
+
+			# update the admin with what happened while it was offline
+			if peer.server_queue:
+				admin.send(peer.server_queue.pop(0))
+
+			admin.send(peer.admin_message('heartbeat'))
 
+		except (ConnectionError, ConnectionResetError, OSError, TimeoutError) as e:
+			peer.server_online = False
+			if not noted:
+				peer.update_listboxes('The connection with admin server was terminated unexpectedly.')
+				noted = True
 
-	except (RuntimeError) as e:
-		time.sleep(2)
-		root.destroy()
+		finally:
+			time.sleep(Peer.HEARTBEAT)
+
+
+def ask_upload(peer: Peer) -> None:
+	"""
+	asks for the file to upload on the gui thread and uploads it on another one
+	:param peer: Peer instance
+	:return: None
+	"""
+	path = filedialog.askopenfilename()
+	if not path:
 		return
+	threading.Thread(target=peer.user_upload, daemon=True, args=(path,)).start()
 
 
 def handle_button_click(peer: Peer, listbox) -> None:
 	"""
-	gets the item selected by the curser before calling to download it
+	gets the item selected by the curser and the directory to save it in before downloading it on another thread
 	:param peer: Peer instance
 	:param listbox: listbox object
 	:return: None
@@ -641,7 +956,10 @@ def handle_button_click(peer: Peer, listbox) -> None:
 	# can't select first item
 	if selected_item == "   Select file to download":
 		return
-	peer.user_download(selected_item)
+	dir = filedialog.askdirectory()
+	if not dir:
+		return
+	threading.Thread(target=peer.user_download, daemon=True, args=(selected_item, dir)).start()
 
 
 if __name__ == '__main__':
@@ -656,8 +974,11 @@ if __name__ == '__main__':
 		with open(filename, 'r') as file:
 			text = file.read()
 
-		# start gui
-		main(Peer(text))
+		# start gui, or only the network side with --headless
+		if '--headless' in sys.argv:
+			main_headless(Peer(text))
+		else:
+			main(Peer(text))
 	except:
 		pass
 	finally:
@@ -0,0 +1,93 @@
+import threading
+from concurrent.futures import Future
+
+import protocol
+
+
+class PendingRequests:
+	"""
+	correlates outstanding requests with their responses. every request gets its own future keyed by
+	its request id, so a waiter blocks on it instead of polling a shared variable
+	"""
+
+	def __init__(self):
+		"""
+		init function
+		"""
+		self.futures = dict()  # request id -> Future
+		self.lock = threading.Lock()
+
+	def register(self) -> tuple:
+		"""
+		creates a future for a new request
+		:return: (request id, Future)
+		"""
+		request_id = protocol.next_request_id()
+		future = Future()
+		with self.lock:
+			self.futures[request_id] = future
+		return request_id, future
+
+	def _take(self, request_id: int):
+		"""
+		removes and returns the future of a request if it is still pending
+		:param request_id: request id
+		:return: Future or None
+		"""
+		with self.lock:
+			future = self.futures.pop(request_id, None)
+		if future is None or future.done():
+			return None
+		return future
+
+	def resolve(self, request_id: int, result) -> bool:
+		"""
+		completes a request with its response
+		:param request_id: request id
+		:param result: response
+		:return: True if someone was waiting for it
+		"""
+		future = self._take(request_id)
+		if future is None:
+			return False
+		future.set_result(result)
+		return True
+
+	def fail(self, request_id: int, error: Exception) -> bool:
+		"""
+		completes a request with an error
+		:param request_id: request id
+		:param error: exception to raise in the waiter
+		:return: True if someone was waiting for it
+		"""
+		future = self._take(request_id)
+		if future is None:
+			return False
+		future.set_exception(error)
+		return True
+
+	def fail_all(self, error: Exception) -> None:
+		"""
+		completes every pending request with an error
+		:param error: exception to raise in the waiters
+		:return: None
+		"""
+		with self.lock:
+			futures, self.futures = self.futures, dict()
+		for future in futures.values():
+			if not future.done():
+				future.set_exception(error)
+
+	def wait(self, request_id: int, future: Future, timeout: float):
+		"""
+		blocks until the request completes or the timeout passes
+		:param request_id: request id
+		:param future: the future returned by register
+		:param timeout: seconds to wait
+		:return: the response
+		"""
+		try:
+			return future.result(timeout)
+		finally:
+			with self.lock:
+				self.futures.pop(request_id, None)
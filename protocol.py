@@ -0,0 +1,212 @@
+import asyncio
+import itertools
+import pickle
+import socket
+import struct
+
+# every message on the wire is a fixed header followed by a raw payload
+# header = (message type: 1 byte, request id: 4 bytes, payload length: 8 bytes), network byte order
+HEADER = struct.Struct('!BIQ')
+
+# message types
+COMMAND = 1  # pickled control message (dict for the admin, tuple between peers)
+DATA = 2  # raw segment bytes
+ACK = 3  # empty payload, confirms the data of a request id was stored by the receiver
+
+RECV_SIZE = 1024 * 256
+
+# the length in a header is checked before anything is allocated for it, so one bad header cannot take all memory
+MAX_COMMAND = 64 * 1024 * 1024  # the file references of a very large file are the largest control message
+MAX_FRAME = 256 * 1024 * 1024  # data payloads are single segments, a piece is far smaller
+
+_request_ids = itertools.count(1)
+
+
+def next_request_id() -> int:
+	"""
+	returns a new request id to correlate a command with its data / response
+	:return: request id
+	"""
+	return next(_request_ids) & 0xFFFFFFFF
+
+
+def pack_header(msg_type: int, request_id: int, length: int) -> bytes:
+	"""
+	packs a frame header
+	:param msg_type: message type
+	:param request_id: request id
+	:param length: payload length in bytes
+	:return: header bytes
+	"""
+	return HEADER.pack(msg_type, request_id, length)
+
+
+def encode_command(command, request_id: int = 0) -> bytes:
+	"""
+	encodes a control message as a whole frame
+	:param command: picklable control message
+	:param request_id: request id
+	:return: frame bytes
+	"""
+	payload = pickle.dumps(command)
+	return pack_header(COMMAND, request_id, len(payload)) + payload
+
+
+def send_command(sock: socket.socket, command, request_id: int = 0) -> None:
+	"""
+	sends a control message
+	:param sock: socket object
+	:param command: picklable control message
+	:param request_id: request id
+	:return: None
+	"""
+	sock.sendall(encode_command(command, request_id))
+
+
+def send_ack(sock: socket.socket, request_id: int) -> None:
+	"""
+	acknowledges that the data of a request was received and stored
+	:param sock: socket object
+	:param request_id: request id of the acknowledged data
+	:return: None
+	"""
+	sock.sendall(pack_header(ACK, request_id, 0))
+
+
+def check_header(msg_type: int, length: int) -> None:
+	"""
+	refuses a frame whose payload is longer than its message type allows
+	:param msg_type: message type
+	:param length: payload length in bytes
+	:return: None
+	"""
+	limit = MAX_COMMAND if msg_type == COMMAND else MAX_FRAME if msg_type == DATA else 0
+	if length > limit:
+		raise ConnectionError(f'Frame of type {msg_type} announces {length} bytes, at most {limit} are accepted')
+
+
+def decode_command(payload: bytes):
+	"""
+	decodes the payload of a COMMAND frame
+	:param payload: raw payload
+	:return: control message
+	"""
+	return pickle.loads(payload)
+
+
+async def read_frame_async(reader: asyncio.StreamReader):
+	"""
+	reads one whole frame from an asyncio stream
+	:param reader: stream reader
+	:return: (message type, request id, payload) or None if the connection was closed
+	"""
+	try:
+		header = await reader.readexactly(HEADER.size)
+	except asyncio.IncompleteReadError as e:
+		if e.partial:
+			raise ConnectionError('Connection closed in the middle of a frame header')
+		return None
+	msg_type, request_id, length = HEADER.unpack(header)
+	check_header(msg_type, length)
+	try:
+		payload = await reader.readexactly(length)
+	except asyncio.IncompleteReadError:
+		raise ConnectionError('Connection closed in the middle of a frame')
+	return msg_type, request_id, payload
+
+
+class FrameReader:
+	"""
+	buffered reader for blocking sockets. rebuilds frames across tcp boundaries
+	"""
+
+	def __init__(self, sock: socket.socket, bufsize: int = RECV_SIZE):
+		"""
+		init function
+		:param sock: socket object
+		:param bufsize: size of a single recv
+		"""
+		self.sock = sock
+		self.bufsize = bufsize
+		self.buffer = bytearray()
+
+	def _fill(self, n: int) -> bool:
+		"""
+		receives until the buffer holds at least n bytes
+		:param n: number of bytes needed
+		:return: False if the connection was closed first
+		"""
+		while len(self.buffer) < n:
+			data = self.sock.recv(self.bufsize)
+			if not data:
+				return False
+			self.buffer += data
+		return True
+
+	def read_header(self):
+		"""
+		reads the header of the next frame
+		:return: (message type, request id, payload length) or None if the connection was closed
+		"""
+		if not self._fill(HEADER.size):
+			if self.buffer:
+				raise ConnectionError('Connection closed in the middle of a frame header')
+			return None
+		header = HEADER.unpack_from(self.buffer)
+		check_header(header[0], header[2])
+		del self.buffer[:HEADER.size]
+		return header
+
+	def read_into(self, view: memoryview) -> None:
+		"""
+		fills a preallocated buffer with the next len(view) bytes of the stream. whatever was already
+		buffered is copied first and the rest is received straight into place
+		:param view: writable memoryview
+		:return: None
+		"""
+		n = min(len(self.buffer), view.nbytes)
+		view[:n] = self.buffer[:n]
+		del self.buffer[:n]
+		while n < view.nbytes:
+			received = self.sock.recv_into(view[n:])
+			if not received:
+				raise ConnectionError('Connection closed in the middle of a frame')
+			n += received
+
+	def read_payload(self, length: int) -> bytearray:
+		"""
+		reads a payload into a buffer allocated once at its final size
+		:param length: payload length
+		:return: payload
+		"""
+		payload = bytearray(length)
+		self.read_into(memoryview(payload))
+		return payload
+
+	def copy_to(self, file, length: int, digest=None) -> None:
+		"""
+		streams a payload into a file through one reused buffer
+		:param file: binary file object
+		:param length: payload length
+		:param digest: optional hashlib object that is updated with the payload as it streams by
+		:return: None
+		"""
+		view = memoryview(bytearray(min(length, self.bufsize)))
+		while length:
+			n = min(length, view.nbytes)
+			self.read_into(view[:n])
+			file.write(view[:n])
+			if digest is not None:
+				digest.update(view[:n])
+			length -= n
+
+	def read_frame(self):
+		"""
+		reads one whole frame. the payload is allocated once at its final size
+		:return: (message type, request id, payload: bytearray) or None if the connection was closed
+		"""
+		header = self.read_header()
+		if header is None:
+			return None
+		msg_type, request_id, length = header
+		return msg_type, request_id, self.read_payload(length)
@@ -0,0 +1,94 @@
+import threading
+from collections import defaultdict
+
+
+class DownloadScheduler:
+	"""
+	keeps several segment requests in flight at once, spread over the peers holding them.
+	a global window bounds the total number of requests and every holder has its own limit
+	so one slow peer cannot take the whole window. a segment that fails is requested again
+	from a holder that was not tried yet
+	"""
+
+	def __init__(self, fetch, holders, max_in_flight: int = 8, per_peer: int = 2):
+		"""
+		init function
+		:param fetch: function(reference, addr) that blocks until the segment arrived, raises on failure or
+		when the segment is corrupted
+		:param holders: function(reference) -> list of (ip, port) that hold the segment, best first
+		:param max_in_flight: max number of segments requested at the same time
+		:param per_peer: max number of segments requested from a single holder at the same time
+		"""
+		self.fetch = fetch
+		self.holders = holders
+		self.max_in_flight = max(1, max_in_flight)
+		self.per_peer = max(1, per_peer)
+
+		self.cond = threading.Condition()
+		self.active = defaultdict(int)  # addr -> requests in flight
+		self.in_flight = 0
+		self.errors = []
+		self.pending = []  # references not yet requested
+		self.tried = defaultdict(set)  # id of reference -> holders that failed it
+
+	def _pick(self, pending: list):
+		"""
+		finds the first pending reference with a holder that has a free slot
+		:param pending: list of references not yet requested
+		:return: (reference, addr) or None
+		"""
+		for reference in pending:
+			for addr in self.holders(reference):
+				if addr not in self.tried[id(reference)] and self.active[addr] < self.per_peer:
+					return reference, addr
+		return None
+
+	def _run_one(self, reference, addr: tuple) -> None:
+		"""
+		a worker thread for one segment
+		:param reference: segment reference
+		:param addr: address of the chosen holder
+		:return: None
+		"""
+		try:
+			self.fetch(reference, addr)
+		except Exception as e:
+			with self.cond:
+				self.tried[id(reference)].add(addr)
+				if set(self.holders(reference)) - self.tried[id(reference)]:
+					self.pending.insert(0, reference)  # another holder may have a good copy
+				else:
+					self.errors.append((reference, e))
+		finally:
+			with self.cond:
+				self.active[addr] -= 1
+				self.in_flight -= 1
+				self.cond.notify()
+
+	def run(self, references: list) -> None:
+		"""
+		downloads every reference and returns when all of them arrived
+		:param references: list of segment references
+		:return: None
+		"""
+		self.pending = pending = list(references)
+		with self.cond:
+			while (pending and not self.errors) or self.in_flight:
+				while pending and not self.errors and self.in_flight < self.max_in_flight:
+					picked = self._pick(pending)
+					if picked is None:  # every holder of every pending segment is busy
+						if not self.in_flight:
+							raise ConnectionError(f'No peer holds segment {pending[0][1]}')
+						break
+					reference, addr = picked
+					pending.remove(reference)
+					self.active[addr] += 1
+					self.in_flight += 1
+					threading.Thread(target=self._run_one, daemon=True, args=(reference, addr)).start()
+
+				self.cond.wait()
+
+			# the requests in flight were allowed to finish before reporting
+			if self.errors:
+				reference, error = self.errors[0]
+				raise ConnectionError(f'Could not retrieve segment {reference[1]}') from error
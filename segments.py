@@ -0,0 +1,161 @@
+import mmap
+import os
+import threading
+
+
+class FileSegments:
+	"""
+	read only memory map of a file that hands out views of its segments. a segment is an
+	(offset, length) range and its bytes are paged in from disk only while they are sent
+	"""
+
+	def __init__(self, path: str):
+		"""
+		init function
+		:param path: path of file
+		"""
+		self.file = open(path, 'rb')
+		self.size = os.stat(self.file.fileno()).st_size
+		# an empty file cannot be mapped
+		self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+
+	def view(self, offset: int, length: int) -> memoryview:
+		"""
+		a zero copy view of a segment
+		:param offset: start of the segment in the file
+		:param length: length of the segment
+		:return: memoryview over the mapped file
+		"""
+		if self.map is None:
+			return memoryview(b'')
+		return memoryview(self.map)[offset:offset + length]
+
+	def close(self) -> None:
+		"""
+		unmaps and closes the file
+		:return: None
+		"""
+		if self.map is not None:
+			try:
+				self.map.close()
+			except BufferError:  # a view is still referenced somewhere, it is unmapped once collected
+				pass
+		self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc) -> None:
+		self.close()
+
+
+class DownloadWriter:
+	"""
+	writes downloaded segments straight to their offsets in a preallocated temporary file and
+	renames it over the destination once every segment is in place. the temporary file outlives
+	an interrupted download so it can be resumed
+	"""
+
+	def __init__(self, path: str, size: int, count: int, piece_size: int = None, resume: bool = False,
+				 on_write=None, written: set = None):
+		"""
+		init function
+		:param path: destination path
+		:param size: file size, None for references from before sizes were recorded
+		:param count: number of segments
+		:param piece_size: length of every segment but the last, None for files from before fixed size pieces
+		:param resume: keep the segments already in the temporary file
+		:param on_write: function(index) called once a segment is in the temporary file
+		:param written: segments already in the temporary file of a resumed download
+		"""
+		self.path = path
+		self.temp_path = path + '.part'
+		self.count = count
+		# every segment but the last has the same length. files from before fixed size pieces were cut
+		# into count equal segments
+		if piece_size is not None:
+			self.base = piece_size
+		else:
+			self.base = size // count if size is not None else None
+		self.held = None  # the last segment while the segment length is still unknown
+		self.lock = threading.Lock()
+		self.on_write = on_write
+		self.written = set(written or ())  # segments in the temporary file
+
+		self.file = open(self.temp_path, 'rb+' if resume and os.path.exists(self.temp_path) else 'wb+')
+		if size is not None:
+			self.file.truncate(size)
+
+	def _write_at(self, offset: int, data) -> None:
+		"""
+		writes data at an offset of the temporary file
+		:param offset: offset in the file
+		:param data: bytes-like object
+		:return: None
+		"""
+		view = memoryview(data)
+		if hasattr(os, 'pwrite'):
+			while view.nbytes:
+				written = os.pwrite(self.file.fileno(), view, offset)
+				view = view[written:]
+				offset += written
+		else:
+			with self.lock:
+				self.file.seek(offset)
+				self.file.write(view)
+
+	def write(self, index: int, data) -> None:
+		"""
+		writes a segment at its offset. safe to call from several threads
+		:param index: segment index
+		:param data: bytes-like object
+		:return: None
+		"""
+		held = None
+		with self.lock:
+			if self.base is None:
+				if index < self.count - 1:
+					self.base = len(data)
+					held, self.held = self.held, None
+				else:
+					self.held = bytes(data)
+					return
+		self._write_at(index * self.base, data)
+		self._written(index)
+		if held is not None:
+			self._write_at((self.count - 1) * self.base, held)
+			self._written(self.count - 1)
+
+	def _written(self, index: int) -> None:
+		"""
+		reports a segment that reached the temporary file
+		:param index: segment index
+		:return: None
+		"""
+		with self.lock:
+			self.written.add(index)
+		if self.on_write is not None:
+			self.on_write(index)
+
+	def commit(self) -> None:
+		"""
+		closes the temporary file and atomically moves it to the destination. raises ValueError and keeps the
+		temporary file open when a segment is missing
+		:return: None
+		"""
+		if self.held is not None:  # a single segment file
+			self._write_at(0, self.held)
+			self._written(0)
+			self.held = None
+		missing = self.count - len(self.written)
+		if missing:
+			raise ValueError(f'{missing} of {self.count} segments were not written')
+		self.file.close()
+		os.replace(self.temp_path, self.path)
+
+	def close(self) -> None:
+		"""
+		closes the temporary file and keeps it for a later attempt
+		:return: None
+		"""
+		self.file.close()
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+import protocol
+
+
+class SegmentStore:
+	"""
+	keeps the segments a peer holds as files on disk. sqlite only indexes them, so serving or
+	receiving a segment never pulls its payload into the python heap. it also remembers which
+	pieces of an unfinished download are already on disk
+	"""
+
+	def __init__(self, user_hash: str):
+		"""
+		init function
+		:param user_hash: username, names the database, its table and the segments directory
+		"""
+		self.user_hash = user_hash
+		self.dir = f'{user_hash}_segments'
+		os.makedirs(self.dir, exist_ok=True)
+		self.lock = threading.Lock()
+
+		self.db = sqlite3.connect(f'{user_hash}.db', check_same_thread=False)
+		cur = self.db.cursor()
+		cur.execute(f"""CREATE TABLE IF NOT EXISTS {user_hash}(
+		           file_name TEXT,
+		           segment_index INT,
+		           max_index INT,
+		           data BLOB,
+		           path TEXT,
+		           codec TEXT);
+		        """)
+		# databases from before the segments were kept as files, and from before they were compressed
+		columns = [column[1] for column in cur.execute(f"PRAGMA table_info({user_hash})")]
+		if 'path' not in columns:
+			cur.execute(f"ALTER TABLE {user_hash} ADD COLUMN path TEXT")
+		if 'codec' not in columns:
+			cur.execute(f"ALTER TABLE {user_hash} ADD COLUMN codec TEXT")
+		# one row per unfinished download, bit i of the bitfield is set once piece i is in the partial file
+		cur.execute("""CREATE TABLE IF NOT EXISTS downloads(
+		           path TEXT PRIMARY KEY,
+		           file_name TEXT,
+		           file_size INT,
+		           piece_size INT,
+		           count INT,
+		           bitfield BLOB);
+		        """)
+		self.db.commit()
+		self.migrate()
+
+	def segment_path(self, file_name: str, index: int) -> str:
+		"""
+		where a segment is kept on disk
+		:param file_name: file name
+		:param index: segment index
+		:return: path
+		"""
+		return os.path.join(self.dir, f'{hashlib.sha1(file_name.encode()).hexdigest()}_{index}.seg')
+
+	def migrate(self) -> None:
+		"""
+		moves segments stored as blobs into files, one row at a time
+		:return: None
+		"""
+		cur = self.db.cursor()
+		rows = cur.execute(f"SELECT rowid, file_name, segment_index FROM {self.user_hash} "
+						   f"WHERE data IS NOT NULL AND path IS NULL").fetchall()
+		for rowid, file_name, index in rows:
+			path = self.segment_path(file_name, index)
+			data = cur.execute(f"SELECT data FROM {self.user_hash} WHERE rowid = ?", (rowid,)).fetchone()[0]
+			with open(path + '.tmp', 'wb') as file:
+				file.write(data)
+			os.replace(path + '.tmp', path)
+			del data
+			cur.execute(f"UPDATE {self.user_hash} SET data = NULL, path = ? WHERE rowid = ?", (path, rowid))
+			self.db.commit()
+		if rows:
+			self.db.execute("VACUUM")
+
+	def _index(self, file_name: str, index: int, max_index: int, path: str, codec: str) -> None:
+		"""
+		adds a stored segment to the index, or points the index at the segment that replaced it
+		:param file_name: file name
+		:param index: segment index
+		:param max_index: highest segment number of og file
+		:param path: path of the segment file
+		:param codec: codec the segment file is compressed with, None if it is not
+		:return: None
+		"""
+		with self.lock:
+			cur = self.db.cursor()
+			cur.execute(f"SELECT 1 FROM {self.user_hash} WHERE file_name = ? AND segment_index = ?", (file_name, index))
+			if cur.fetchone() is None:
+				cur.execute(f"INSERT INTO {self.user_hash} VALUES(?, ?, ?, NULL, ?, ?);",
+							(file_name, index, max_index, path, codec))
+			else:
+				cur.execute(f"UPDATE {self.user_hash} SET path = ?, codec = ? WHERE file_name = ? AND segment_index = ?",
+							(path, codec, file_name, index))
+			self.db.commit()
+
+	def receive(self, reader: protocol.FrameReader, length: int, file_name: str, index: int, max_index: int,
+				expected: bytes = None, codec: str = None) -> bool:
+		"""
+		streams the payload of a DATA frame straight into a segment file, hashing it on the way. a compressed
+		segment is kept compressed
+		:param reader: frame reader positioned right after the frame header
+		:param length: payload length
+		:param file_name: file name
+		:param index: index of segment
+		:param max_index: highest segment number of og file
+		:param expected: sha1 digest the segment must have, None to keep it unchecked
+		:param codec: codec the payload is compressed with, None if it is not
+		:return: True if the segment was stored, False if it did not match its digest
+		"""
+		path = self.segment_path(file_name, index)
+		digest = hashlib.sha1() if expected is not None else None
+		with open(path + '.tmp', 'wb') as file:
+			reader.copy_to(file, length, digest)
+		if digest is not None and digest.digest() != expected:
+			os.remove(path + '.tmp')
+			return False
+		os.replace(path + '.tmp', path)
+		self._index(file_name, index, max_index, path, codec)
+		return True
+
+	def find(self, file_name: str, index: int):
+		"""
+		queries for a segment that matches the file name and index
+		:param file_name: file name
+		:param index: index of segment
+		:return: (file name, index, max index, path, codec) or None
+		"""
+		with self.lock:
+			cur = self.db.cursor()
+			cur.execute(f"SELECT file_name, segment_index, max_index, path, codec FROM {self.user_hash} "
+						f"WHERE file_name = ? AND segment_index = ? AND path IS NOT NULL", (file_name, index))
+			row = cur.fetchone()
+		if row is None or not os.path.exists(row[3]):
+			return None
+		return row
+
+	def start_download(self, path: str, file_name: str, file_size: int, piece_size: int, count: int) -> set:
+		"""
+		registers a download, or picks up the interrupted download of the same file to the same path
+		:param path: destination path
+		:param file_name: file name
+		:param file_size: file size
+		:param piece_size: piece size
+		:param count: number of pieces
+		:return: indexes of the pieces already in the partial file
+		"""
+		with self.lock:
+			cur = self.db.cursor()
+			cur.execute("SELECT file_name, file_size, piece_size, count, bitfield FROM downloads WHERE path = ?", (path,))
+			row = cur.fetchone()
+			if row is not None and row[:4] == (file_name, file_size, piece_size, count) and os.path.exists(path + '.part'):
+				return {index for index in range(count) if row[4][index // 8] >> (index % 8) & 1}
+
+			# a new download, or the file changed since the last attempt
+			cur.execute("INSERT OR REPLACE INTO downloads VALUES(?, ?, ?, ?, ?, ?);",
+						(path, file_name, file_size, piece_size, count, bytes((count + 7) // 8)))
+			self.db.commit()
+			return set()
+
+	def mark_piece(self, path: str, index: int) -> None:
+		"""
+		records that a piece of a download is in the partial file
+		:param path: destination path
+		:param index: piece index
+		:return: None
+		"""
+		with self.lock:
+			cur = self.db.cursor()
+			cur.execute("SELECT bitfield FROM downloads WHERE path = ?", (path,))
+			row = cur.fetchone()
+			if row is None:
+				return
+			bitfield = bytearray(row[0])
+			bitfield[index // 8] |= 1 << (index % 8)
+			cur.execute("UPDATE downloads SET bitfield = ? WHERE path = ?", (bytes(bitfield), path))
+			self.db.commit()
+
+	def finish_download(self, path: str) -> None:
+		"""
+		forgets a download once the file is complete
+		:param path: destination path
+		:return: None
+		"""
+		with self.lock:
+			self.db.execute("DELETE FROM downloads WHERE path = ?", (path,))
+			self.db.commit()
+
+	def incomplete_downloads(self) -> list:
+		"""
+		the downloads that were interrupted
+		:return: list of (file name, path, pieces on disk, number of pieces)
+		"""
+		with self.lock:
+			cur = self.db.cursor()
+			cur.execute("SELECT file_name, path, bitfield, count FROM downloads ORDER BY rowid")
+			rows = cur.fetchall()
+		return [(file_name, path, bin(int.from_bytes(bitfield, 'little')).count('1'), count)
+				for file_name, path, bitfield, count in rows]
@@ -0,0 +1,87 @@
+import os
+import socket
+import threading
+import time
+
+import protocol
+
+CHUNK_SIZE = 1024 * 1024  # granularity of the rate cap
+ACK_TIMEOUT = 30  # seconds to wait for the receiver to confirm a segment
+
+
+class RateLimiter:
+	"""
+	token bucket for capping upload bandwidth. one limiter is shared by every upload of a peer
+	"""
+
+	def __init__(self, rate: float = None, burst: int = None):
+		"""
+		init function
+		:param rate: bytes per second, None for no cap
+		:param burst: how many bytes can be sent at once after being idle
+		"""
+		self.rate = rate
+		self.capacity = burst or rate or 0
+		self.tokens = self.capacity
+		self.last = time.monotonic()
+		self.lock = threading.Lock()
+
+	def consume(self, n: int) -> None:
+		"""
+		takes n bytes worth of tokens and sleeps until the bucket can afford them
+		:param n: number of bytes about to be sent
+		:return: None
+		"""
+		if not self.rate:
+			return
+		with self.lock:
+			now = time.monotonic()
+			self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+			self.last = now
+			self.tokens -= n
+			deficit = -self.tokens
+		if deficit > 0:
+			time.sleep(deficit / self.rate)
+
+
+def send_payload(sock: socket.socket, data, request_id: int, limiter: RateLimiter = None) -> None:
+	"""
+	sends a segment as one DATA frame. the pace is set by tcp backpressure (sendall blocks while
+	the receiver's window is full) and optionally by a rate limiter
+	:param sock: socket object
+	:param data: bytes-like object
+	:param request_id: request id of the segment
+	:param limiter: RateLimiter or None
+	:return: None
+	"""
+	view = memoryview(data)
+	sock.sendall(protocol.pack_header(protocol.DATA, request_id, view.nbytes))
+	if limiter is None or not limiter.rate:
+		sock.sendall(view)
+		return
+	for start in range(0, view.nbytes, CHUNK_SIZE):
+		chunk = view[start:start + CHUNK_SIZE]
+		limiter.consume(chunk.nbytes)
+		sock.sendall(chunk)
+
+
+def send_file(sock: socket.socket, path: str, request_id: int, limiter: RateLimiter = None) -> None:
+	"""
+	sends a file as one DATA frame with socket.sendfile, the payload goes from the page cache to
+	the socket without passing through python
+	:param sock: socket object
+	:param path: path of the file
+	:param request_id: request id of the segment
+	:param limiter: RateLimiter or None
+	:return: None
+	"""
+	with open(path, 'rb') as file:
+		size = os.stat(file.fileno()).st_size
+		sock.sendall(protocol.pack_header(protocol.DATA, request_id, size))
+		if limiter is None or not limiter.rate:
+			sock.sendfile(file)
+			return
+		for offset in range(0, size, CHUNK_SIZE):
+			count = min(CHUNK_SIZE, size - offset)
+			limiter.consume(count)
+			sock.sendfile(file, offset, count)
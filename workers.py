@@ -0,0 +1,132 @@
+import queue
+import selectors
+import socket
+import threading
+import time
+import traceback
+
+
+class WorkerPool:
+	"""
+	a fixed number of daemon threads running jobs from a queue. with a bounded queue submit blocks once
+	it is full, which is how the peer server stops accepting connections it cannot serve yet. jobs of work
+	that was let in already are queued past the bound without blocking
+	"""
+
+	def __init__(self, workers: int, queue_size: int = 0, name: str = 'worker'):
+		"""
+		init function
+		:param workers: number of threads
+		:param queue_size: max jobs waiting for a thread, 0 for no limit
+		:param name: thread name prefix
+		"""
+		self.jobs = queue.Queue()
+		self.queue_size = queue_size
+		self.space = threading.Condition()  # notified whenever a job leaves the queue
+		for i in range(workers):
+			threading.Thread(target=self.run, daemon=True, name=f'{name}-{i}').start()
+
+	def submit(self, function, *args, wait: bool = True) -> None:
+		"""
+		queues a job
+		:param function: function to run
+		:param args: its arguments
+		:param wait: block while the queue is full, False queues the job regardless
+		:return: None
+		"""
+		if wait and self.queue_size:
+			with self.space:
+				self.space.wait_for(lambda: self.jobs.qsize() < self.queue_size)
+		self.jobs.put((function, args))
+
+	def pending(self) -> int:
+		"""
+		jobs waiting for a thread
+		:return: number of jobs
+		"""
+		return self.jobs.qsize()
+
+	def run(self) -> None:
+		"""
+		the loop of every thread. a failed job is printed and does not stop the thread
+		:return: None
+		"""
+		while True:
+			function, args = self.jobs.get()
+			if self.queue_size:
+				with self.space:
+					self.space.notify()
+			try:
+				function(*args)
+			except Exception:
+				traceback.print_exc()
+
+
+class Poller:
+	"""
+	watches idle connections from one thread so they do not hold a worker while they wait for their next
+	frame. a connection is handed back with a callback as soon as it is readable, and dropped once it
+	stayed silent for too long
+	"""
+
+	def __init__(self, timeout: float):
+		"""
+		init function
+		:param timeout: seconds a connection may stay silent before it is dropped
+		"""
+		self.timeout = timeout
+		self.selector = selectors.DefaultSelector()
+		self.lock = threading.Lock()
+		# a byte on this pair wakes the selector up so new connections are watched right away
+		self.wakeup, self.waker = socket.socketpair()
+		self.wakeup.setblocking(False)
+		self.selector.register(self.wakeup, selectors.EVENT_READ)
+		threading.Thread(target=self.run, daemon=True, name='poller').start()
+
+	def register(self, sock: socket.socket, on_ready, on_idle, busy=None) -> None:
+		"""
+		watches a connection until it is readable or silent for too long, whichever comes first
+		:param sock: socket object
+		:param on_ready: function() called once the socket is readable
+		:param on_idle: function() called once the socket was silent for too long, it is not watched anymore
+		:param busy: function() -> True while replies are still being sent on the connection. it is not dropped
+		meanwhile, its silence counts from the time it was seen busy last
+		:return: None
+		"""
+		with self.lock:
+			self.selector.register(sock, selectors.EVENT_READ, (on_ready, on_idle, time.monotonic(), busy))
+		self.waker.send(b'\0')
+
+	def run(self) -> None:
+		"""
+		the loop of the poller thread
+		:return: None
+		"""
+		while True:
+			ready = []
+			for key, _ in self.selector.select(min(self.timeout, 1)):
+				if key.fileobj is self.wakeup:
+					try:
+						self.wakeup.recv(4096)
+					except BlockingIOError:
+						pass
+					continue
+				ready.append(key)
+
+			now = time.monotonic()
+			readable = {key.fd for key in ready}
+			with self.lock:
+				idle = [key for key in self.selector.get_map().values()
+						if key.data is not None and key.fd not in readable and now - key.data[2] > self.timeout]
+				# a connection still sending replies is not silent, it is watched again from now on
+				busy = [key for key in idle if key.data[3] is not None and key.data[3]()]
+				for key in busy:
+					self.selector.modify(key.fileobj, selectors.EVENT_READ, key.data[:2] + (now,) + key.data[3:])
+				idle = [key for key in idle if key not in busy]
+				for key in ready + idle:
+					self.selector.unregister(key.fileobj)
+
+			for key in ready:
+				key.data[0]()
+			for key in idle:
+				key.data[1]()